@@ -8,6 +8,7 @@ class ProjectModel(BaseModel):
     labels: List[str] = Field(default_factory=list)
     relation_types: List[str] = Field(default_factory=list)
     allow_overlap: bool = False
+    revision: int = 0
     created_at: datetime
 
 class DocumentModel(BaseModel):
@@ -17,6 +18,9 @@ class DocumentModel(BaseModel):
     status: Optional[str] = None
     source_file: Optional[str] = None
     unit_index: Optional[int] = None
+    start_offset: Optional[int] = None
+    end_offset: Optional[int] = None
+    revision: int = 0
     created_at: datetime
 
 class AnnotationModel(BaseModel):
@@ -27,6 +31,16 @@ class AnnotationModel(BaseModel):
     label: str
     created_at: datetime
 
+class SuggestionModel(BaseModel):
+    id: int
+    doc_id: int
+    start: int
+    end: int
+    label: str
+    text: str
+    source: str
+    created_at: datetime
+
 class RelationModel(BaseModel):
     id: int
     doc_id: int
@@ -1,12 +1,100 @@
+import bisect
 import logging
-from typing import List
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
 from sqlalchemy import select, delete, update
 from ..storage.db import get_session, init_db
-from ..storage.schema import Annotation, Document, Project
+from ..storage.schema import Annotation, Document
 from ..models import AnnotationModel
+from . import revision_service, cache_service, project_service
 
 logger = logging.getLogger(__name__)
 
+class SpanIndex:
+    """Spans of one document sorted by start; overlap checks bisect a window of the longest span length."""
+    def __init__(self, revision: int, rows: Iterable[Tuple[int, int, int]] = ()):
+        self.revision = revision
+        self._starts: List[int] = []
+        self._ends: List[int] = []
+        self._ids: List[int] = []
+        self._by_id: Dict[int, Tuple[int, int]] = {}
+        self._lengths: Counter = Counter()
+        self._max_len = 0
+        for ann_id, start, end in sorted(rows, key=lambda r: r[1]):
+            self._starts.append(start)
+            self._ends.append(end)
+            self._ids.append(ann_id)
+            self._track(ann_id, start, end)
+
+    def _track(self, ann_id: int, start: int, end: int):
+        self._by_id[ann_id] = (start, end)
+        self._lengths[end - start] += 1
+        self._max_len = max(self._max_len, end - start)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def overlapping(self, start: int, end: int, exclude: Optional[int] = None) -> Optional[int]:
+        """Returns the id of a span overlapping [start, end), or None."""
+        lo = bisect.bisect_right(self._starts, start - self._max_len)
+        hi = bisect.bisect_left(self._starts, end)
+        for i in range(lo, hi):
+            if self._ends[i] > start and self._ids[i] != exclude:
+                return self._ids[i]
+        return None
+
+    def add(self, ann_id: int, start: int, end: int):
+        i = bisect.bisect_right(self._starts, start)
+        self._starts.insert(i, start)
+        self._ends.insert(i, end)
+        self._ids.insert(i, ann_id)
+        self._track(ann_id, start, end)
+
+    def remove(self, ann_id: int):
+        if ann_id not in self._by_id:
+            return
+        start, end = self._by_id.pop(ann_id)
+        i = bisect.bisect_left(self._starts, start)
+        while self._ids[i] != ann_id:
+            i += 1
+        del self._starts[i], self._ends[i], self._ids[i]
+        n = end - start
+        self._lengths[n] -= 1
+        if not self._lengths[n]:
+            del self._lengths[n]
+            if n == self._max_len:
+                self._max_len = max(self._lengths, default=0)
+
+def _span_index(s, d: Document) -> SpanIndex:
+    # Built from the covering (doc_id, start, end) index when the cached one
+    # is missing or belongs to another revision or document
+    idx = cache_service.get_span_index(d.id, d.created_at, d.revision)
+    if idx is None:
+        rows = s.execute(select(Annotation.id, Annotation.start, Annotation.end).where(Annotation.doc_id == d.id)).all()
+        idx = SpanIndex(d.revision, rows)
+        cache_service.put_span_index(d.id, d.created_at, idx)
+    return idx
+
+def _check_overlap(s, d: Document, start: int, end: int, exclude: Optional[int] = None):
+    with cache_service.span_index_lock:
+        if _span_index(s, d).overlapping(start, end, exclude) is not None:
+            raise ValueError("span overlap")
+
+def _advance_span_index(doc_id: int, created_at, revision: int, apply):
+    # Called after commit with the revision the write produced. The cached
+    # index is patched only if it is exactly one revision behind, i.e. no
+    # other writer touched the document in between.
+    with cache_service.span_index_lock:
+        idx = cache_service.get_span_index(doc_id, created_at, revision - 1)
+        if idx is None:
+            cache_service.invalidate_span_index(doc_id)
+            return
+        apply(idx)
+        idx.revision = revision
+
+def _document_revision(s, doc_id: int) -> int:
+    return s.execute(select(Document.revision).where(Document.id == doc_id)).scalar()
+
 def list_spans(doc_id: int) -> List[AnnotationModel]:
     init_db()
     s = get_session()
@@ -24,22 +112,21 @@ def add_span(doc_id: int, start: int, end: int, label: str) -> AnnotationModel:
         d = s.get(Document, doc_id)
         if not d:
             raise ValueError("document not found")
-        p = s.get(Project, d.project_id)
-        if not p:
-            raise ValueError("project not found")
-        if label not in p.labels:
+        schema = project_service.get_schema(d.project_id, s)
+        if label not in schema.labels:
             raise ValueError("label not in project")
         if start < 0 or end < 0 or start >= end or end > len(d.text):
             raise ValueError("invalid span")
-        if not bool(p.allow_overlap):
-            q = select(Annotation).where(Annotation.doc_id == doc_id)
-            rows = s.execute(q).scalars().all()
-            for r in rows:
-                if not (end <= r.start or start >= r.end):
-                    raise ValueError("span overlap")
+        if not schema.allow_overlap:
+            _check_overlap(s, d, start, end)
         a = Annotation(doc_id=doc_id, start=start, end=end, label=label)
         s.add(a)
+        revision_service.bump_documents(s, [doc_id])
+        revision_service.bump_project(s, d.project_id)
+        s.flush()
+        ann_id, created_at, revision = a.id, d.created_at, _document_revision(s, doc_id)
         s.commit()
+        _advance_span_index(doc_id, created_at, revision, lambda idx: idx.add(ann_id, start, end))
         s.refresh(a)
         return AnnotationModel(id=a.id, doc_id=a.doc_id, start=a.start, end=a.end, label=a.label, created_at=a.created_at)
     finally:
@@ -55,21 +142,24 @@ def update_span(ann_id: int, start: int, end: int, label: str) -> AnnotationMode
         d = s.get(Document, a0.doc_id)
         if not d:
             raise ValueError("document not found")
-        p = s.get(Project, d.project_id)
-        if not p:
-            raise ValueError("project not found")
-        if label not in p.labels:
+        schema = project_service.get_schema(d.project_id, s)
+        if label not in schema.labels:
             raise ValueError("label not in project")
         if start < 0 or end < 0 or start >= end or end > len(d.text):
             raise ValueError("invalid span")
-        if not bool(p.allow_overlap):
-            q = select(Annotation).where(Annotation.doc_id == d.id, Annotation.id != ann_id)
-            rows = s.execute(q).scalars().all()
-            for r in rows:
-                if not (end <= r.start or start >= r.end):
-                    raise ValueError("span overlap")
+        if not schema.allow_overlap:
+            _check_overlap(s, d, start, end, exclude=ann_id)
         s.execute(update(Annotation).where(Annotation.id == ann_id).values(start=start, end=end, label=label).execution_options(synchronize_session="fetch"))
+        revision_service.bump_documents(s, [d.id])
+        revision_service.bump_project(s, d.project_id)
+        doc_id, created_at = d.id, d.created_at
+        revision = _document_revision(s, doc_id)
         s.commit()
+
+        def move(idx):
+            idx.remove(ann_id)
+            idx.add(ann_id, start, end)
+        _advance_span_index(doc_id, created_at, revision, move)
         a = s.get(Annotation, ann_id)
         return AnnotationModel(id=a.id, doc_id=a.doc_id, start=a.start, end=a.end, label=a.label, created_at=a.created_at)
     finally:
@@ -79,9 +169,18 @@ def delete_span(ann_id: int) -> bool:
     init_db()
     s = get_session()
     try:
+        d = s.execute(select(Document).join(Annotation, Annotation.doc_id == Document.id).where(Annotation.id == ann_id)).scalar_one_or_none()
         q = delete(Annotation).where(Annotation.id == ann_id)
         res = s.execute(q)
+        revision = None
+        if d is not None:
+            doc_id, created_at = d.id, d.created_at
+            revision_service.bump_documents(s, [doc_id])
+            revision_service.bump_project(s, d.project_id)
+            revision = _document_revision(s, doc_id)
         s.commit()
+        if revision is not None:
+            _advance_span_index(doc_id, created_at, revision, lambda idx: idx.remove(ann_id))
         return res.rowcount > 0
     finally:
         s.close()
\ No newline at end of file
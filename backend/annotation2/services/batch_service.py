@@ -0,0 +1,260 @@
+import logging
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy import select, delete, bindparam
+from ..storage.db import get_session, init_db
+from ..storage.schema import Document, Annotation, Relation
+from ..storage import bulk
+from . import revision_service, project_service
+from .annotation_service import SpanIndex
+
+logger = logging.getLogger(__name__)
+
+# Batch span/relation mutations, validated in order against an in-memory
+# copy of the affected documents and written in one transaction. Operations:
+#   {"op": "add_span", "doc_id", "start", "end", "label", "ref"?}
+#   {"op": "update_span", "id", "start"?, "end"?, "label"?}
+#   {"op": "delete_span", "id"}
+#   {"op": "add_relation", "doc_id", "from_id", "to_id", "relation_type"}
+#   {"op": "update_relation", "id", "relation_type"}
+#   {"op": "delete_relation", "id"}
+# A span id may be the "ref" string of a span added earlier in the batch.
+
+BATCH_OPS = ("add_span", "update_span", "delete_span", "add_relation", "update_relation", "delete_relation")
+MAX_BATCH_OPS = 10000
+
+class _State:
+    """Loaded rows of the affected documents, mutated as operations validate."""
+    def __init__(self):
+        self.docs: Dict[int, Document] = {}
+        self.projects: Dict[int, project_service.ProjectSchema] = {}
+        self.spans: Dict[Any, list] = {}       # id or temp key -> [doc_id, start, end, label]
+        self.relations: Dict[Any, list] = {}   # id or temp key -> [doc_id, from, to, type]
+        # (doc_id, from, to, type) -> count, for the duplicate check (stored
+        # relations may already repeat), and span key -> its relation keys
+        self.relation_rows: Counter = Counter()
+        self.span_relations: Dict[Any, set] = defaultdict(set)
+        self.indexes: Dict[int, SpanIndex] = {}
+        self.refs: Dict[str, Any] = {}
+        self.touched: set = set()
+        self.updated_spans: set = set()
+        self.updated_relations: set = set()
+        self.deleted_spans: set = set()
+        self.deleted_relations: set = set()
+        self._next_temp = 0
+
+    def temp_key(self) -> Tuple[str, int]:
+        self._next_temp += 1
+        return ("new", self._next_temp)
+
+    def put_relation(self, key, row: list):
+        self.relations[key] = row
+        self.relation_rows[tuple(row)] += 1
+        self.span_relations[row[1]].add(key)
+        self.span_relations[row[2]].add(key)
+
+    def pop_relation(self, key) -> list:
+        row = self.relations.pop(key)
+        self.relation_rows[tuple(row)] -= 1
+        if not self.relation_rows[tuple(row)]:
+            del self.relation_rows[tuple(row)]
+        self.span_relations[row[1]].discard(key)
+        self.span_relations[row[2]].discard(key)
+        return row
+
+def _ids(ops: List[dict], *keys) -> set:
+    return {o[k] for o in ops for k in keys if isinstance(o.get(k), int)}
+
+def _load(s, ops: List[dict]) -> _State:
+    st = _State()
+    span_ids = _ids([o for o in ops if str(o.get("op")).endswith("_span")], "id") | _ids(ops, "from_id", "to_id")
+    rel_ids = _ids([o for o in ops if str(o.get("op")).endswith("_relation")], "id")
+    doc_ids = _ids(ops, "doc_id")
+    if span_ids:
+        doc_ids |= set(s.execute(select(Annotation.doc_id).where(Annotation.id.in_(span_ids))).scalars())
+    if rel_ids:
+        doc_ids |= set(s.execute(select(Relation.doc_id).where(Relation.id.in_(rel_ids))).scalars())
+    if not doc_ids:
+        return st
+    st.docs = {d.id: d for d in s.execute(select(Document).where(Document.id.in_(doc_ids))).scalars()}
+    project_ids = {d.project_id for d in st.docs.values()}
+    st.projects = {p: project_service.get_schema(p, s) for p in project_ids}
+    ids = list(st.docs)
+    for a_id, doc_id, start, end, label in s.execute(select(Annotation.id, Annotation.doc_id, Annotation.start, Annotation.end, Annotation.label).where(Annotation.doc_id.in_(ids))):
+        st.spans[a_id] = [doc_id, start, end, label]
+    for r_id, doc_id, f, t, rtype in s.execute(select(Relation.id, Relation.doc_id, Relation.from_ann_id, Relation.to_ann_id, Relation.relation_type).where(Relation.doc_id.in_(ids))):
+        st.put_relation(r_id, [doc_id, f, t, rtype])
+    for doc_id, d in st.docs.items():
+        if not st.projects[d.project_id].allow_overlap:
+            st.indexes[doc_id] = SpanIndex(d.revision, [(k, v[1], v[2]) for k, v in st.spans.items() if v[0] == doc_id])
+    return st
+
+def _doc(st: _State, doc_id) -> Document:
+    d = st.docs.get(doc_id)
+    if d is None:
+        raise ValueError("document not found")
+    return d
+
+def _span_key(st: _State, ref) -> Any:
+    key = st.refs.get(ref) if isinstance(ref, str) else ref
+    if key is None or key not in st.spans:
+        raise ValueError(f"annotation not found: {ref}")
+    return key
+
+def _check_span(st: _State, d: Document, start, end, label, exclude=None):
+    p = st.projects[d.project_id]
+    if label not in p.labels:
+        raise ValueError("label not in project")
+    if not isinstance(start, int) or not isinstance(end, int) or start < 0 or start >= end or end > len(d.text):
+        raise ValueError("invalid span")
+    idx = st.indexes.get(d.id)
+    if idx is not None and idx.overlapping(start, end, exclude) is not None:
+        raise ValueError("span overlap")
+
+def _apply(st: _State, o: dict) -> Any:
+    # Validates one operation and applies it to the state; returns the id
+    # (or temp key) of the affected row. Every check runs before the first
+    # mutation, so a failed operation leaves the state as it was.
+    op = o.get("op")
+    if op == "add_span":
+        d = _doc(st, o.get("doc_id"))
+        _check_span(st, d, o.get("start"), o.get("end"), o.get("label"))
+        ref = o.get("ref")
+        if ref is not None and (not isinstance(ref, str) or ref in st.refs):
+            raise ValueError("ref must be a new string")
+        key = st.temp_key()
+        if ref is not None:
+            st.refs[ref] = key
+        st.spans[key] = [d.id, o["start"], o["end"], o["label"]]
+        if d.id in st.indexes:
+            st.indexes[d.id].add(key, o["start"], o["end"])
+        st.touched.add(d.id)
+        return key
+    if op == "update_span":
+        key = _span_key(st, o.get("id"))
+        doc_id, start, end, label = st.spans[key]
+        d = st.docs[doc_id]
+        start, end, label = o.get("start", start), o.get("end", end), o.get("label", label)
+        _check_span(st, d, start, end, label, exclude=key)
+        st.spans[key] = [doc_id, start, end, label]
+        st.updated_spans.add(key)
+        if doc_id in st.indexes:
+            st.indexes[doc_id].remove(key)
+            st.indexes[doc_id].add(key, start, end)
+        st.touched.add(doc_id)
+        return key
+    if op == "delete_span":
+        key = _span_key(st, o.get("id"))
+        doc_id = st.spans.pop(key)[0]
+        if doc_id in st.indexes:
+            st.indexes[doc_id].remove(key)
+        # Relations go with their spans, as the foreign key cascade does
+        for r_key in list(st.span_relations.get(key, ())):
+            st.pop_relation(r_key)
+        st.span_relations.pop(key, None)
+        if not isinstance(key, tuple):
+            st.deleted_spans.add(key)
+        st.touched.add(doc_id)
+        return key
+    if op == "add_relation":
+        d = _doc(st, o.get("doc_id"))
+        f, t = _span_key(st, o.get("from_id")), _span_key(st, o.get("to_id"))
+        if st.spans[f][0] != d.id or st.spans[t][0] != d.id:
+            raise ValueError("annotation not in document")
+        rtype = o.get("relation_type")
+        if rtype not in st.projects[d.project_id].relation_types:
+            raise ValueError("relation type not in project")
+        if (d.id, f, t, rtype) in st.relation_rows:
+            raise ValueError("relation exists")
+        key = st.temp_key()
+        st.put_relation(key, [d.id, f, t, rtype])
+        st.touched.add(d.id)
+        return key
+    if op == "update_relation":
+        key = o.get("id")
+        if key not in st.relations:
+            raise ValueError("relation not found")
+        r = st.relations[key]
+        rtype = o.get("relation_type")
+        if rtype not in st.projects[st.docs[r[0]].project_id].relation_types:
+            raise ValueError("relation type not in project")
+        r = st.pop_relation(key)
+        st.put_relation(key, r[:3] + [rtype])
+        st.updated_relations.add(key)
+        st.touched.add(r[0])
+        return key
+    if op == "delete_relation":
+        key = o.get("id")
+        if key not in st.relations:
+            raise ValueError("relation not found")
+        doc_id = st.pop_relation(key)[0]
+        st.deleted_relations.add(key)
+        st.touched.add(doc_id)
+        return key
+    raise ValueError("unknown op")
+
+def apply_batch(ops: List[Dict[str, Any]], atomic: bool = True, revisions: Optional[Dict[int, int]] = None) -> Dict[str, Any]:
+    """Validates and applies ops in one transaction; returns {"committed", "results", "revisions"}."""
+    if len(ops) > MAX_BATCH_OPS:
+        raise ValueError(f"at most {MAX_BATCH_OPS} operations per batch")
+    if not all(isinstance(o, dict) for o in ops):
+        raise ValueError("operations must be objects")
+    init_db()
+    s = get_session()
+    try:
+        st = _load(s, ops)
+        results: List[Dict[str, Any]] = []
+        for i, o in enumerate(ops):
+            try:
+                results.append({"index": i, "ok": True, "key": _apply(st, o)})
+            except (ValueError, TypeError) as e:
+                results.append({"index": i, "ok": False, "error": str(e) if isinstance(e, ValueError) else f"invalid operation: {e}"})
+        failed = [r for r in results if not r["ok"]]
+        if (atomic and failed) or not st.touched:
+            for r in results:
+                r.pop("key", None)
+            return {"committed": False, "results": results, "revisions": {}}
+
+        real = _write(s, st)
+        expected = {int(k): v for k, v in (revisions or {}).items() if int(k) in st.touched}
+        revision_service.check_and_bump_documents(s, expected)
+        revision_service.bump_documents(s, [d for d in st.touched if d not in expected])
+        for project_id in {st.docs[d].project_id for d in st.touched}:
+            revision_service.bump_project(s, project_id)
+        new_revisions = revision_service.current_revisions(s, sorted(st.touched))
+        s.commit()
+        for r in results:
+            key = r.pop("key", None)
+            if r["ok"]:
+                r["id"] = real.get(key, key)
+        return {"committed": True, "results": results, "revisions": new_revisions}
+    finally:
+        s.close()
+
+def _write(s, st: _State) -> Dict[Any, int]:
+    """Writes the net effect of the state; returns temp key -> new id."""
+    conn = s.connection()
+    if st.deleted_relations:
+        s.execute(delete(Relation).where(Relation.id.in_(list(st.deleted_relations))))
+    if st.deleted_spans:
+        ids = list(st.deleted_spans)
+        s.execute(delete(Relation).where(Relation.from_ann_id.in_(ids) | Relation.to_ann_id.in_(ids)))
+        s.execute(delete(Annotation).where(Annotation.id.in_(ids)))
+    touched_spans = [(k, st.spans[k]) for k in st.updated_spans if not isinstance(k, tuple) and k in st.spans]
+    if touched_spans:
+        t = Annotation.__table__
+        stmt = t.update().where(t.c.id == bindparam("b_id")).values(start=bindparam("b_start"), end=bindparam("b_end"), label=bindparam("b_label"))
+        conn.execute(stmt, [{"b_id": k, "b_start": v[1], "b_end": v[2], "b_label": v[3]} for k, v in touched_spans])
+    new_spans = [(k, v) for k, v in st.spans.items() if isinstance(k, tuple)]
+    ids = bulk.insert_annotations(s, [{"doc_id": v[0], "start": v[1], "end": v[2], "label": v[3]} for _, v in new_spans])
+    real = {k: i for (k, _), i in zip(new_spans, ids)}
+    touched_rels = [(k, st.relations[k]) for k in st.updated_relations if k in st.relations]
+    if touched_rels:
+        t = Relation.__table__
+        conn.execute(t.update().where(t.c.id == bindparam("b_id")).values(relation_type=bindparam("b_type")),
+                     [{"b_id": k, "b_type": v[3]} for k, v in touched_rels])
+    new_rels = [(k, v) for k, v in st.relations.items() if isinstance(k, tuple)]
+    rows = [{"doc_id": v[0], "from_ann_id": real.get(v[1], v[1]), "to_ann_id": real.get(v[2], v[2]), "relation_type": v[3]} for _, v in new_rels]
+    rel_ids = bulk.insert_relations(s, rows)
+    real.update({k: i for (k, _), i in zip(new_rels, rel_ids)})
+    return real
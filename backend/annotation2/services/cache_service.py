@@ -0,0 +1,99 @@
+import os
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+class LRUCache:
+    """Small thread-safe LRU map used for in-process caches."""
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._data: "OrderedDict[Any, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            return self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+# Serialized project snapshots, stored with the project version they were
+# built at (see revision_service.version_tag); any other version is a miss.
+_snapshots = LRUCache(int(os.environ.get("ANNOTATION2_SNAPSHOT_CACHE_SIZE", "16")))
+
+def get_snapshot(project_id: int, version: str) -> Optional[bytes]:
+    hit: Optional[Tuple[str, bytes]] = _snapshots.get(project_id)
+    if hit is None or hit[0] != version:
+        return None
+    return hit[1]
+
+def put_snapshot(project_id: int, version: str, payload: bytes):
+    _snapshots.put(project_id, (version, payload))
+
+def invalidate_project(project_id: int):
+    _snapshots.pop(project_id)
+
+# Per-document span indexes for overlap checks, stored with the document's
+# created_at and revision (see revision_service.version_tag).
+_span_indexes = LRUCache(int(os.environ.get("ANNOTATION2_SPAN_INDEX_CACHE_SIZE", "256")))
+span_index_lock = threading.Lock()
+
+def get_span_index(doc_id: int, created_at, revision: int):
+    entry = _span_indexes.get(doc_id)
+    if entry is None or entry[0] != created_at or entry[1].revision != revision:
+        return None
+    return entry[1]
+
+def put_span_index(doc_id: int, created_at, idx):
+    _span_indexes.put(doc_id, (created_at, idx))
+
+def invalidate_span_index(doc_id: int):
+    _span_indexes.pop(doc_id)
+
+def invalidate_span_indexes(doc_ids: Iterable[int]):
+    with span_index_lock:
+        for doc_id in doc_ids:
+            _span_indexes.pop(doc_id)
+
+# Project schemas for span and relation validation. Writers invalidate after
+# commit; the epoch stops a reader caching a schema loaded before that.
+_schemas = LRUCache(int(os.environ.get("ANNOTATION2_SCHEMA_CACHE_SIZE", "256")))
+_schema_epoch = 0
+_schema_lock = threading.Lock()
+
+def schema_epoch() -> int:
+    return _schema_epoch
+
+def get_project_schema(project_id: int):
+    return _schemas.get(project_id)
+
+def put_project_schema(project_id: int, schema, epoch: int):
+    with _schema_lock:
+        if epoch == _schema_epoch:
+            _schemas.put(project_id, schema)
+
+def invalidate_project_schema(project_id: int):
+    global _schema_epoch
+    with _schema_lock:
+        _schema_epoch += 1
+        _schemas.pop(project_id)
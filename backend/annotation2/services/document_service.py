@@ -4,6 +4,7 @@ from sqlalchemy import select
 from ..storage.db import get_session, init_db
 from ..storage.schema import Document, Project
 from ..models import DocumentModel
+from . import revision_service
 
 logger = logging.getLogger(__name__)
 
@@ -19,10 +20,11 @@ def import_texts(project_id: int, texts: List[str]) -> List[DocumentModel]:
             d = Document(project_id=project_id, text=t)
             s.add(d)
             docs.append(d)
+        revision_service.bump_project(s, project_id)
         s.commit()
         for d in docs:
             s.refresh(d)
-        return [DocumentModel(id=d.id, project_id=d.project_id, text=d.text, status=d.status, source_file=d.source_file, unit_index=d.unit_index, created_at=d.created_at) for d in docs]
+        return [DocumentModel(id=d.id, project_id=d.project_id, text=d.text, status=d.status, source_file=d.source_file, unit_index=d.unit_index, start_offset=d.start_offset, end_offset=d.end_offset, revision=d.revision, created_at=d.created_at) for d in docs]
     finally:
         s.close()
 
@@ -32,7 +34,7 @@ def list_documents(project_id: int, limit: int = 50, offset: int = 0) -> List[Do
     try:
         q = select(Document).where(Document.project_id == project_id).order_by(Document.id.asc()).limit(limit).offset(offset)
         rows = s.execute(q).scalars().all()
-        return [DocumentModel(id=r.id, project_id=r.project_id, text=r.text, status=r.status, source_file=r.source_file, unit_index=r.unit_index, created_at=r.created_at) for r in rows]
+        return [DocumentModel(id=r.id, project_id=r.project_id, text=r.text, status=r.status, source_file=r.source_file, unit_index=r.unit_index, start_offset=r.start_offset, end_offset=r.end_offset, revision=r.revision, created_at=r.created_at) for r in rows]
     finally:
         s.close()
 
@@ -43,6 +45,6 @@ def get_document(doc_id: int) -> DocumentModel:
         d = s.get(Document, doc_id)
         if not d:
             raise ValueError("document not found")
-        return DocumentModel(id=d.id, project_id=d.project_id, text=d.text, status=d.status, source_file=d.source_file, unit_index=d.unit_index, created_at=d.created_at)
+        return DocumentModel(id=d.id, project_id=d.project_id, text=d.text, status=d.status, source_file=d.source_file, unit_index=d.unit_index, start_offset=d.start_offset, end_offset=d.end_offset, revision=d.revision, created_at=d.created_at)
     finally:
         s.close()
\ No newline at end of file
@@ -1,132 +1,642 @@
 import os
+import re
 import json
+import time
+import hashlib
+import zlib
+import shutil
+import tempfile
+import itertools
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from typing import Optional, List
+from typing import Optional, List, Iterator, Iterable, Tuple
 from sqlalchemy import select
-from ..storage.db import get_session, init_db
+from ..storage.db import get_session, init_db, init_worker, begin_read
 from ..storage.schema import Document, Annotation, Relation, Project
+from . import revision_service
 
-def export_project(project_id: int, fmt: str = "jsonl", output_dir: Optional[str] = None, doc_ids: Optional[List[int]] = None) -> str:
+EXPORT_FORMATS = ("json_v2", "jsonl", "tsv", "csv", "bio", "conll", "parquet")
+
+# Written as bytes by parquet_service rather than through the text renderers
+BINARY_FORMATS = ("parquet",)
+
+MEDIA_TYPES = {
+    "json_v2": "application/json",
+    "jsonl": "application/x-ndjson",
+    "tsv": "text/tab-separated-values",
+    "csv": "text/csv",
+    "bio": "application/x-ndjson",
+    "conll": "text/plain",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+_EXTENSIONS = {"json_v2": "json", "jsonl": "jsonl", "tsv": "tsv", "csv": "csv", "bio": "bio.jsonl", "conll": "conll", "parquet": "parquet"}
+
+def _normalize_format(fmt: str) -> str:
+    f = (fmt or "").lower()
+    if f not in EXPORT_FORMATS:
+        raise ValueError("unsupported format")
+    return f
+
+def export_filename(project_id: int, fmt: str, ts: Optional[str] = None) -> str:
+    f = _normalize_format(fmt)
+    ts = ts or datetime.utcnow().strftime("%Y%m%d_%H%M%S")
+    return f"project_{project_id}_{ts}.{_EXTENSIONS[f]}"
+
+EXPORT_FETCH_SIZE = 2000
+BULK_ID_CHUNK = 900
+
+def _merge_by_doc(doc_id: int, it, pending: list) -> list:
+    # it yields rows ordered by doc_id (column 1); pending holds the lookahead row
+    out = []
+    row = pending.pop() if pending else next(it, None)
+    while row is not None:
+        row_doc = row[1]
+        if row_doc > doc_id:
+            pending.append(row)
+            break
+        if row_doc == doc_id:
+            out.append(row)
+        row = next(it, None)
+    return out
+
+def _iter_docs(s, project_id: int, doc_ids: Optional[List[int]], id_range: Optional[Tuple[int, int]] = None) -> Iterator[Tuple[Document, list, list]]:
+    """Merges ordered scans of documents, annotations and relations into (document, anns, rels)."""
+    q_docs = select(Document.id, Document.text, Document.status, Document.unit_index, Document.created_at).where(Document.project_id == project_id)
+    q_anns = (select(Annotation.id, Annotation.doc_id, Annotation.start, Annotation.end, Annotation.label)
+              .join(Document, Document.id == Annotation.doc_id).where(Document.project_id == project_id))
+    q_rels = (select(Relation.id, Relation.doc_id, Relation.from_ann_id, Relation.to_ann_id, Relation.relation_type)
+              .join(Document, Document.id == Relation.doc_id).where(Document.project_id == project_id))
+    if doc_ids:
+        q_docs = q_docs.where(Document.id.in_(doc_ids))
+        q_anns = q_anns.where(Annotation.doc_id.in_(doc_ids))
+        q_rels = q_rels.where(Relation.doc_id.in_(doc_ids))
+    if id_range:
+        lo, hi = id_range
+        q_docs = q_docs.where(Document.id.between(lo, hi))
+        q_anns = q_anns.where(Annotation.doc_id.between(lo, hi))
+        q_rels = q_rels.where(Relation.doc_id.between(lo, hi))
+    # Core connection, not the ORM session: rows skip ORM loading entirely
+    conn = s.connection().execution_options(yield_per=EXPORT_FETCH_SIZE)
+    docs = conn.execute(q_docs.order_by(Document.id.asc()))
+    anns = iter(conn.execute(q_anns.order_by(Annotation.doc_id.asc(), Annotation.id.asc())))
+    rels = iter(conn.execute(q_rels.order_by(Relation.doc_id.asc(), Relation.id.asc())))
+    ann_pending: list = []
+    rel_pending: list = []
+    for d in docs:
+        yield d, _merge_by_doc(d.id, anns, ann_pending), _merge_by_doc(d.id, rels, rel_pending)
+
+def _json_v2_document(d, anns, rels) -> dict:
+    # Map Ann ID to Export ID
+    ann_id_map = {a.id: f"ent_{i+1}" for i, a in enumerate(anns)}
+
+    entities = []
+    for a in anns:
+        entities.append({
+            "id": ann_id_map[a.id],
+            "start_offset": a.start,
+            "end_offset": a.end,
+            "label": a.label,
+            "text": d.text[a.start:a.end],
+            "confidence": 1.0  # Default
+        })
+
+    relations = []
+    for i, r in enumerate(rels):
+        if r.from_ann_id in ann_id_map and r.to_ann_id in ann_id_map:
+            relations.append({
+                "id": f"rel_{i+1}",
+                "from_entity_id": ann_id_map[r.from_ann_id],
+                "to_entity_id": ann_id_map[r.to_ann_id],
+                "relation_type": r.relation_type,
+                "confidence": 1.0 # Default
+            })
+
+    return {
+        "text_id": f"doc_{d.id}_unit_{d.unit_index or 0}",
+        "original_text": d.text,
+        "annotations": {
+            "entities": entities,
+            "relations": relations
+        },
+        "metadata": {
+            "annotator": "current_user", # Default
+            "annotation_time": d.created_at.isoformat() if d.created_at else None,
+            "status": d.status
+        }
+    }
+
+def _render_json_v2(d, anns, rels) -> str:
+    return json_dumps(_json_v2_document(d, anns, rels))
+
+def _render_jsonl(d, anns, rels) -> str:
+    anns = sorted(anns, key=lambda a: (a.start, a.end))
+    entities = [{"start": a.start, "end": a.end, "label": a.label} for a in anns]
+    idx = {a.id: i for i, a in enumerate(anns)}
+    relations = []
+    for r in rels:
+        if r.from_ann_id in idx and r.to_ann_id in idx:
+            relations.append({"from_entity": idx[r.from_ann_id], "to_entity": idx[r.to_ann_id], "relation": r.relation_type})
+    obj = {"text": d.text, "entities": entities, "relations": relations}
+    return json_dumps(obj) + "\n"
+
+def _render_separated(sep: str):
+    def render(d, anns, rels) -> str:
+        lines = []
+        for a in sorted(anns, key=lambda a: a.start):
+            frag = d.text[a.start:a.end]
+            lines.append(sep.join([str(d.id), str(a.start), str(a.end), a.label, frag.replace("\t"," ").replace("\n"," ")]) + "\n")
+        return "".join(lines)
+    return render
+
+def _spans(anns) -> list:
+    return [(a.start, a.end, a.label) for a in anns]
+
+def _render_bio(tagger):
+    # One JSON line per document with parallel token and tag lists
+    def render(d, anns, rels) -> str:
+        tokens, tags = tagger.tag(d.text, _spans(anns))
+        return json_dumps({"doc_id": d.id, "tokens": tokens, "tags": tags}) + "\n"
+    return render
+
+def _render_conll(tagger):
+    # "token<TAB>tag" per line, a blank line after each document
+    def render(d, anns, rels) -> str:
+        tokens, tags = tagger.tag(d.text, _spans(anns))
+        lines = [t + "\t" + g for t, g in zip(tokens, tags) if not t.isspace()]
+        return "\n".join(lines) + "\n\n" if lines else ""
+    return render
+
+def _make_renderer(f: str, options: dict):
+    if f == "json_v2":
+        return _render_json_v2
+    if f == "jsonl":
+        return _render_jsonl
+    if f in ("tsv", "csv"):
+        return _render_separated("\t" if f == "tsv" else ",")
+    from .tagging_service import BioTagger
+    tagger = BioTagger(options["labels"], options["allow_overlap"], options["tokenization"])
+    return _render_bio(tagger) if f == "bio" else _render_conll(tagger)
+
+def _envelope(f: str, options: dict) -> Tuple[str, str, str]:
+    # (head, separator between documents, tail) around the rendered documents
+    if f == "json_v2":
+        return '{"project_info": ' + json_dumps(options.get("project_info")) + ', "documents": [\n', ",\n", "\n]}\n"
+    if f in ("tsv", "csv"):
+        sep = "\t" if f == "tsv" else ","
+        return sep.join(["doc_id","start","end","label","fragment"]) + "\n", "", ""
+    return "", "", ""
+
+def _export_options(s, project_id: int, f: str, tokenization: str = "char") -> dict:
+    # Everything a renderer needs from the project, picklable for shard workers
+    p = s.get(Project, project_id)
+    options = {"tokenization": tokenization}
+    if f == "json_v2":
+        options["project_info"] = {
+            "project_name": p.name if p else "Unknown",
+            "export_time": datetime.utcnow().isoformat(),
+            "version": "1.0"
+        }
+    if f in ("bio", "conll"):
+        options["labels"] = list(p.labels) if p else []
+        options["allow_overlap"] = bool(p.allow_overlap) if p else False
+    return options
+
+def _write_body(f: str, options: dict, rows: Iterable, stats: Optional[dict] = None) -> Iterator[str]:
+    # Documents only, joined by the format separator. The document array is
+    # emitted one element at a time so the full export is never in memory.
+    render = _make_renderer(f, options)
+    sep = _envelope(f, options)[1]
+    first = True
+    for d, anns, rels in rows:
+        if stats is not None:
+            stats["documents"] = stats.get("documents", 0) + 1
+            stats.setdefault("first_doc_id", d.id)
+            stats["last_doc_id"] = d.id
+        chunk = render(d, anns, rels)
+        if not chunk:
+            continue
+        yield chunk if first else sep + chunk
+        first = False
+    if stats is not None:
+        stats["empty"] = first
+
+def _write(f: str, options: dict, rows: Iterable) -> Iterator[str]:
+    head, _, tail = _envelope(f, options)
+    if head:
+        yield head
+    yield from _write_body(f, options, rows)
+    if tail:
+        yield tail
+
+def _write_bytes(f: str, options: dict, rows: Iterable, compress: bool = False) -> Iterator[bytes]:
+    if f in BINARY_FORMATS:
+        from .parquet_service import iter_parquet
+        return iter_parquet(rows)
+    chunks = (c.encode("utf-8") for c in _write(f, options, rows))
+    return gzip_chunks(chunks) if compress else chunks
+
+def _check_format(f: str, tokenization: str = "char", compress: bool = False):
+    # Fail before any streaming starts when an optional dependency is missing
+    if f in ("bio", "conll"):
+        from .tagging_service import BioTagger
+        BioTagger([], False, tokenization)
+    if f in BINARY_FORMATS:
+        from .parquet_service import require_pyarrow
+        require_pyarrow()
+        if compress:
+            raise ValueError("parquet is compressed internally, gzip is not supported")
+
+def iter_export(project_id: int, fmt: str = "jsonl", doc_ids: Optional[List[int]] = None, tokenization: str = "char") -> Iterator[str]:
+    """Returns a generator of text chunks; the format is checked before streaming starts."""
+    f = _normalize_format(fmt)
+    if f in BINARY_FORMATS:
+        raise ValueError(f"{f} is a binary format, use iter_export_bytes")
+    _check_format(f, tokenization)
+    init_db()
+
+    def gen():
+        s = get_session()
+        try:
+            options = _export_options(s, project_id, f, tokenization)
+            yield from _write(f, options, _iter_docs(s, project_id, doc_ids))
+        finally:
+            s.close()
+    return gen()
+
+def iter_export_bytes(project_id: int, fmt: str = "jsonl", doc_ids: Optional[List[int]] = None, compress: bool = False, tokenization: str = "char") -> Iterator[bytes]:
+    f = _normalize_format(fmt)
+    _check_format(f, tokenization, compress)
+    init_db()
+
+    def gen():
+        s = get_session()
+        try:
+            options = _export_options(s, project_id, f, tokenization)
+            yield from _write_bytes(f, options, _iter_docs(s, project_id, doc_ids), compress)
+        finally:
+            s.close()
+    return gen()
+
+def gzip_chunks(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    z = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for c in chunks:
+        out = z.compress(c)
+        if out:
+            yield out
+    yield z.flush()
+
+# Saved exports are named by a hash of everything that determines their
+# bytes, project version included; sharded ones are "_shards" directories.
+EXPORT_CACHE_MAX_BYTES = int(os.environ.get("ANNOTATION2_EXPORT_CACHE_MAX_BYTES", str(1 << 30)))
+EXPORT_CACHE_MAX_AGE = int(os.environ.get("ANNOTATION2_EXPORT_CACHE_MAX_AGE", str(7 * 24 * 3600)))
+_CACHED_NAME_RE = re.compile(r"^project_\d+_r\d+_[0-9a-f]{16}\.")
+_CACHED_DIR_RE = re.compile(r"^project_\d+_r\d+_[0-9a-f]{16}_shards$")
+
+def export_cache_key(project_id: int, f: str, doc_ids: Optional[List[int]], version: str, compress: bool, tokenization: str, shards: Optional[int] = None) -> str:
+    key = {
+        "project_id": project_id,
+        "format": f,
+        "doc_ids": sorted(set(doc_ids)) if doc_ids else None,
+        "version": version,
+        "compress": bool(compress),
+        "tokenization": tokenization if f in ("bio", "conll") else None,
+        "shards": shards,
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()
+
+def _cached_name(project_id: int, f: str, doc_ids: Optional[List[int]], compress: bool, tokenization: str, shards: Optional[int] = None) -> str:
+    """Cache entry name for the current project version, without extension."""
     init_db()
     s = get_session()
     try:
-        q_docs = select(Document).where(Document.project_id == project_id)
-        if doc_ids:
-            q_docs = q_docs.where(Document.id.in_(doc_ids))
-        q_docs = q_docs.order_by(Document.id.asc())
-        docs = s.execute(q_docs).scalars().all()
-        if output_dir is None:
-            base_dir = os.path.join(os.path.dirname(__file__), "..", "exports")
+        row = s.execute(select(Project.created_at, Project.revision).where(Project.id == project_id)).first()
+    finally:
+        s.close()
+    if row is None:
+        raise ValueError("project not found")
+    key = export_cache_key(project_id, f, doc_ids, revision_service.version_tag(*row), compress, tokenization, shards)
+    return f"project_{project_id}_r{row[1]}_{key[:16]}"
+
+def export_project(project_id: int, fmt: str = "jsonl", output_dir: Optional[str] = None, doc_ids: Optional[List[int]] = None, compress: bool = False, tokenization: str = "char") -> str:
+    """Writes the export to disk, reusing a cached file of the same version and options."""
+    f = _normalize_format(fmt)
+    _check_format(f, tokenization, compress)
+    base_dir = _exports_dir(output_dir)
+    name = _cached_name(project_id, f, doc_ids, compress, tokenization)
+    path = os.path.join(base_dir, f"{name}.{_EXTENSIONS[f]}" + (".gz" if compress else ""))
+    if os.path.exists(path):
+        # mtime doubles as last use for eviction
+        os.utime(path)
+        return path
+
+    chunks = iter_export_bytes(project_id, f, doc_ids, compress=compress, tokenization=tokenization)
+    fd, tmp = tempfile.mkstemp(prefix=".export_", dir=base_dir)
+    try:
+        with os.fdopen(fd, "wb") as fo:
+            for c in chunks:
+                fo.write(c)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    prune_export_cache(base_dir, keep=[path])
+    return path
+
+def prune_export_cache(output_dir: Optional[str] = None, max_bytes: Optional[int] = None, max_age: Optional[int] = None, keep: Iterable[str] = ()) -> List[str]:
+    """Evicts cached exports by age, then by LRU until under max_bytes; returns the removed paths."""
+    base_dir = _exports_dir(output_dir)
+    max_bytes = EXPORT_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    max_age = EXPORT_CACHE_MAX_AGE if max_age is None else max_age
+    keep = {os.path.abspath(p) for p in keep}
+    now = time.time()
+    entries = []
+    for e in os.scandir(base_dir):
+        if os.path.abspath(e.path) in keep:
+            continue
+        if e.is_file() and _CACHED_NAME_RE.match(e.name):
+            st = e.stat()
+            entries.append((st.st_mtime, st.st_size, e.path))
+        elif e.is_dir() and _CACHED_DIR_RE.match(e.name):
+            entries.append((e.stat().st_mtime, _tree_size(e.path), e.path))
+    total = sum(size for _, size, _ in entries) + sum(_tree_size(p) if os.path.isdir(p) else os.path.getsize(p) for p in keep if os.path.exists(p))
+    removed = []
+    for mtime, size, path in sorted(entries):
+        if now - mtime <= max_age and total <= max_bytes:
+            continue
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
         else:
-            base_dir = output_dir
-        os.makedirs(base_dir, exist_ok=True)
-        ts = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
-
-        if fmt.lower() == "json_v2":
-            # New Feature: Structured JSON Export
-            path = os.path.join(base_dir, f"project_{project_id}_{ts}.json")
-            
-            # Fetch project info
-            p = s.get(Project, project_id)
-            project_info = {
-                "project_name": p.name if p else "Unknown",
-                "export_time": datetime.utcnow().isoformat(),
-                "version": "1.0"
-            }
-
-            export_docs = []
-            for d in docs:
-                # Fetch Annotations
-                q_anns = select(Annotation).where(Annotation.doc_id == d.id).order_by(Annotation.id.asc())
-                anns = s.execute(q_anns).scalars().all()
-                
-                # Map Ann ID to Export ID
-                ann_id_map = {a.id: f"ent_{i+1}" for i, a in enumerate(anns)}
-                
-                entities = []
-                for a in anns:
-                    entities.append({
-                        "id": ann_id_map[a.id],
-                        "start_offset": a.start,
-                        "end_offset": a.end,
-                        "label": a.label,
-                        "text": d.text[a.start:a.end],
-                        "confidence": 1.0  # Default
-                    })
-
-                # Fetch Relations
-                q_rels = select(Relation).where(Relation.doc_id == d.id).order_by(Relation.id.asc())
-                rels = s.execute(q_rels).scalars().all()
-                
-                relations = []
-                for i, r in enumerate(rels):
-                    if r.from_ann_id in ann_id_map and r.to_ann_id in ann_id_map:
-                        relations.append({
-                            "id": f"rel_{i+1}",
-                            "from_entity_id": ann_id_map[r.from_ann_id],
-                            "to_entity_id": ann_id_map[r.to_ann_id],
-                            "relation_type": r.relation_type,
-                            "confidence": 1.0 # Default
-                        })
-
-                doc_obj = {
-                    "text_id": f"doc_{d.id}_unit_{d.unit_index or 0}",
-                    "original_text": d.text,
-                    "annotations": {
-                        "entities": entities,
-                        "relations": relations
-                    },
-                    "metadata": {
-                        "annotator": "current_user", # Default
-                        "annotation_time": d.created_at.isoformat() if d.created_at else None,
-                        "status": d.status
-                    }
-                }
-                export_docs.append(doc_obj)
-
-            final_obj = {
-                "project_info": project_info,
-                "documents": export_docs
-            }
-            
-            with open(path, "w", encoding="utf-8") as f:
-                f.write(json.dumps(final_obj, indent=2, ensure_ascii=False))
-            return path
-
-        if fmt.lower() == "jsonl":
-            path = os.path.join(base_dir, f"project_{project_id}_{ts}.jsonl")
-            with open(path, "w", encoding="utf-8") as f:
-                for d in docs:
-                    q_anns = select(Annotation).where(Annotation.doc_id == d.id).order_by(Annotation.start.asc(), Annotation.end.asc())
-                    anns = s.execute(q_anns).scalars().all()
-                    entities = [{"start": a.start, "end": a.end, "label": a.label} for a in anns]
-                    idx = {a.id: i for i, a in enumerate(anns)}
-                    q_rels = select(Relation).where(Relation.doc_id == d.id).order_by(Relation.id.asc())
-                    rels = s.execute(q_rels).scalars().all()
-                    relations = []
-                    for r in rels:
-                        if r.from_ann_id in idx and r.to_ann_id in idx:
-                            relations.append({"from_entity": idx[r.from_ann_id], "to_entity": idx[r.to_ann_id], "relation": r.relation_type})
-                    obj = {"text": d.text, "entities": entities, "relations": relations}
-                    f.write(json_dumps(obj) + "\n")
-            return path
-        if fmt.lower() in {"tsv", "csv"}:
-            sep = "\t" if fmt.lower() == "tsv" else ","
-            path = os.path.join(base_dir, f"project_{project_id}_{ts}.{fmt.lower()}")
-            with open(path, "w", encoding="utf-8") as f:
-                f.write(sep.join(["doc_id","start","end","label","fragment"]) + "\n")
-                for d in docs:
-                    q_anns = select(Annotation).where(Annotation.doc_id == d.id).order_by(Annotation.start.asc())
-                    anns = s.execute(q_anns).scalars().all()
-                    for a in anns:
-                        frag = d.text[a.start:a.end]
-                        row = sep.join([str(d.id), str(a.start), str(a.end), a.label, frag.replace("\t"," ").replace("\n"," ")])
-                        f.write(row + "\n")
-            return path
-        raise ValueError("unsupported format")
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        total -= size
+        removed.append(path)
+    return removed
+
+def _tree_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(d, n)) for d, _, names in os.walk(path) for n in names)
+
+def _manifest_path(base_dir: str, project_id: int, f: str) -> str:
+    return os.path.join(base_dir, f"project_{project_id}.{f}.manifest.json")
+
+def _delta_path(base_dir: str, project_id: int, f: str, since: Optional[str], watermark: str, compress: bool) -> str:
+    return os.path.join(base_dir, f"project_{project_id}_{since or '0'}-{watermark}.delta.{_EXTENSIONS[f]}" + (".gz" if compress else ""))
+
+def _same_project(a: Optional[str], b: str) -> bool:
+    # Compares the created_at part of two version tags
+    return isinstance(a, str) and a.rsplit("-r", 1)[0] == b.rsplit("-r", 1)[0]
+
+def export_incremental(project_id: int, fmt: str = "jsonl", output_dir: Optional[str] = None, compress: bool = False, tokenization: str = "char", reset: bool = False) -> dict:
+    """Exports documents created or modified since the last incremental export and reports deleted ones."""
+    f = _normalize_format(fmt)
+    _check_format(f, tokenization, compress)
+    base_dir = _exports_dir(output_dir)
+    manifest_path = _manifest_path(base_dir, project_id, f)
+    manifest = {"project_id": project_id, "format": f, "watermark": None, "documents": {}, "history": []}
+    if not reset and os.path.exists(manifest_path):
+        with open(manifest_path, "r", encoding="utf-8") as fi:
+            manifest = json.load(fi)
+
+    init_db()
+    s = get_session()
+    try:
+        # Version, fingerprints and export rows come from one read snapshot
+        begin_read(s)
+        watermark = revision_service.project_version(s, project_id)
+        if watermark is None:
+            raise ValueError("project not found")
+        if not _same_project(manifest["watermark"], watermark):
+            # Manifest of an earlier project with this id (see revision_service.version_tag)
+            manifest = {"project_id": project_id, "format": f, "watermark": None, "documents": {}, "history": []}
+        summary = {"path": None, "manifest": manifest_path, "watermark": watermark,
+                   "previous_watermark": manifest["watermark"], "created": 0, "modified": 0, "deleted": []}
+        if manifest["watermark"] == watermark:
+            return summary
+
+        q = select(Document.id, Document.revision, Document.created_at).where(Document.project_id == project_id).order_by(Document.id.asc())
+        current = {str(i): [rev, created.isoformat() if created else None] for i, rev, created in s.execute(q)}
+        previous = manifest["documents"]
+        created_ids = [int(k) for k in current if k not in previous]
+        modified_ids = [int(k) for k, fp in current.items() if k in previous and previous[k] != fp]
+        deleted_ids = sorted(int(k) for k in previous if k not in current)
+        changed = sorted(created_ids + modified_ids)
+
+        path = None
+        if changed:
+            options = _export_options(s, project_id, f, tokenization)
+            if len(changed) == len(current):
+                rows = _iter_docs(s, project_id, None)
+            else:
+                rows = itertools.chain.from_iterable(
+                    _iter_docs(s, project_id, changed[i:i + BULK_ID_CHUNK]) for i in range(0, len(changed), BULK_ID_CHUNK))
+            path = _delta_path(base_dir, project_id, f, manifest["watermark"], watermark, compress)
+            fd, tmp = tempfile.mkstemp(prefix=".delta_", dir=base_dir)
+            try:
+                with os.fdopen(fd, "wb") as fo:
+                    for c in _write_bytes(f, options, rows, compress):
+                        fo.write(c)
+                os.replace(tmp, path)
+            except BaseException:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                raise
+    finally:
+        s.close()
+
+    summary.update({"path": path, "created": len(created_ids), "modified": len(modified_ids), "deleted": deleted_ids})
+    manifest["watermark"] = watermark
+    manifest["documents"] = current
+    manifest["history"].append({
+        "file": os.path.basename(path) if path else None,
+        "exported_at": datetime.utcnow().isoformat(),
+        "watermark": watermark,
+        "created": len(created_ids),
+        "modified": len(modified_ids),
+        "deleted": deleted_ids,
+    })
+    # Replace atomically so an interrupted run keeps the old watermark
+    tmp = manifest_path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as fo:
+        json.dump(manifest, fo, ensure_ascii=False)
+    os.replace(tmp, manifest_path)
+    return summary
+
+def delete_project_exports(project_id: int, output_dir: Optional[str] = None) -> List[str]:
+    """Removes the project's saved exports, incremental manifests and deltas."""
+    base_dir = _exports_dir(output_dir)
+    own = re.compile(rf"^project_{project_id}(?:_r\d+_[0-9a-f]{{16}}|\.[a-z0-9_]+\.manifest\.json(?:\.tmp)?$|_[0-9_r-]+\.delta\.)")
+    removed = []
+    for e in os.scandir(base_dir):
+        if not own.match(e.name):
+            continue
+        if e.is_dir():
+            shutil.rmtree(e.path, ignore_errors=True)
+        else:
+            try:
+                os.remove(e.path)
+            except FileNotFoundError:
+                pass
+        removed.append(e.path)
+    return removed
+
+def _exports_dir(output_dir: Optional[str]) -> str:
+    base_dir = output_dir if output_dir is not None else os.path.join(os.path.dirname(__file__), "..", "exports")
+    os.makedirs(base_dir, exist_ok=True)
+    return base_dir
+
+def _encode(text: str, compress: bool) -> bytes:
+    # gzip members can be concatenated, so compressed pieces are written as
+    # independent members and the result is still one valid .gz file
+    data = text.encode("utf-8")
+    return b"".join(gzip_chunks([data])) if compress else data
+
+def _plan_shards(s, project_id: int, doc_ids: Optional[List[int]], n: int) -> List[Tuple[int, int]]:
+    q = select(Document.id).where(Document.project_id == project_id)
+    if doc_ids:
+        q = q.where(Document.id.in_(doc_ids))
+    ids = s.execute(q.order_by(Document.id.asc())).scalars().all()
+    if not ids:
+        return []
+    size = -(-len(ids) // max(1, n))
+    return [(ids[i], ids[min(i + size, len(ids)) - 1]) for i in range(0, len(ids), size)]
+
+def _counted(rows: Iterable, stats: dict) -> Iterator:
+    for row in rows:
+        d = row[0]
+        stats["documents"] = stats.get("documents", 0) + 1
+        stats.setdefault("first_doc_id", d.id)
+        stats["last_doc_id"] = d.id
+        yield row
+    stats["empty"] = "documents" not in stats
+
+def _export_shard(task: dict) -> dict:
+    init_db()
+    s = get_session()
+    try:
+        f = task["format"]
+        rows = _iter_docs(s, task["project_id"], task["doc_ids"], task["id_range"])
+        stats = {}
+        options = task["options"]
+        if f in BINARY_FORMATS:
+            # Always a complete file; a binary shard has no text separator
+            chunks = _write_bytes(f, options, _counted(rows, stats))
+        elif task["complete"]:
+            head, _, tail = _envelope(f, options)
+            chunks = itertools.chain([head], _write_body(f, options, rows, stats), [tail])
+        else:
+            chunks = _write_body(f, options, rows, stats)
+        if f not in BINARY_FORMATS:
+            chunks = (c.encode("utf-8") for c in chunks if c)
+            if task["compress"]:
+                chunks = gzip_chunks(chunks)
+        with open(task["path"], "wb") as fo:
+            for c in chunks:
+                fo.write(c)
+        return {
+            "file": os.path.basename(task["path"]),
+            "documents": stats.get("documents", 0),
+            "first_doc_id": stats.get("first_doc_id"),
+            "last_doc_id": stats.get("last_doc_id"),
+            "empty": stats.get("empty", True),
+            "bytes": os.path.getsize(task["path"]),
+        }
+    finally:
+        s.close()
+
+def export_project_parallel(project_id: int, fmt: str = "jsonl", workers: int = 4, output_dir: Optional[str] = None, doc_ids: Optional[List[int]] = None, shards: Optional[int] = None, merge: bool = True, compress: bool = False, tokenization: str = "char") -> str:
+    """Exports shards in a process pool into one file (merge) or a shard directory; cached like export_project."""
+    f = _normalize_format(fmt)
+    _check_format(f, tokenization, compress)
+    if f in BINARY_FORMATS and merge:
+        raise ValueError(f"{f} shards cannot be concatenated, export them as separate files")
+    base_dir = _exports_dir(output_dir)
+    ext = _EXTENSIONS[f] + (".gz" if compress else "")
+    if merge:
+        # Same content as a serial export, so the same cache entry
+        name = _cached_name(project_id, f, doc_ids, compress, tokenization)
+        final = os.path.join(base_dir, f"{name}.{ext}")
+    else:
+        name = _cached_name(project_id, f, doc_ids, compress, tokenization, shards=shards or workers)
+        final = os.path.join(base_dir, f"{name}_shards")
+    cached = final if merge else os.path.join(final, "manifest.json")
+    if os.path.exists(cached):
+        os.utime(final)
+        return cached
+
+    init_db()
+    s = get_session()
+    try:
+        ranges = _plan_shards(s, project_id, doc_ids, shards or workers)
+        options = _export_options(s, project_id, f, tokenization)
     finally:
         s.close()
 
+    work_dir = tempfile.mkdtemp(prefix=".export_shards_", dir=base_dir)
+    tasks = [{
+        "project_id": project_id,
+        "format": f,
+        "doc_ids": doc_ids,
+        "id_range": r,
+        "options": options,
+        "complete": not merge,
+        "compress": compress,
+        "path": os.path.join(work_dir, f"part-{i:05d}.{ext}"),
+    } for i, r in enumerate(ranges)]
+
+    if len(tasks) > 1 and workers > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks)), initializer=init_worker) as pool:
+            results = list(pool.map(_export_shard, tasks))
+    else:
+        results = [_export_shard(t) for t in tasks]
+
+    if not merge:
+        manifest = {
+            "project_id": project_id,
+            "format": f,
+            "compressed": compress,
+            "created_at": datetime.utcnow().isoformat(),
+            "documents": sum(r["documents"] for r in results),
+            "shards": [{k: v for k, v in r.items() if k != "empty"} for r in results],
+        }
+        with open(os.path.join(work_dir, "manifest.json"), "w", encoding="utf-8") as fo:
+            fo.write(json.dumps(manifest, ensure_ascii=False, indent=2))
+        try:
+            os.rename(work_dir, final)
+        except OSError:
+            # A concurrent export of the same version got there first
+            shutil.rmtree(work_dir, ignore_errors=True)
+            if not os.path.exists(cached):
+                raise
+        prune_export_cache(base_dir, keep=[final])
+        return cached
+
+    head, sep, tail = _envelope(f, options)
+    fd, tmp = tempfile.mkstemp(prefix=".export_", dir=base_dir)
+    try:
+        with os.fdopen(fd, "wb") as fo:
+            if head:
+                fo.write(_encode(head, compress))
+            first = True
+            for t, r in zip(tasks, results):
+                if r["empty"]:
+                    continue
+                if not first and sep:
+                    fo.write(_encode(sep, compress))
+                with open(t["path"], "rb") as fi:
+                    shutil.copyfileobj(fi, fo)
+                first = False
+            if tail:
+                fo.write(_encode(tail, compress))
+        os.replace(tmp, final)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        shutil.rmtree(work_dir, ignore_errors=True)
+    prune_export_cache(base_dir, keep=[final])
+    return final
+
 def json_dumps(obj) -> str:
-    import json
-    return json.dumps(obj, ensure_ascii=False)
\ No newline at end of file
+    return json.dumps(obj, ensure_ascii=False)
@@ -0,0 +1,246 @@
+import logging
+from collections import deque, defaultdict
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+from sqlalchemy import select, delete, func
+from ..storage.db import get_session, init_db
+from ..storage.schema import Document, Annotation, Suggestion
+from ..models import SuggestionModel
+from . import project_service, batch_service
+from .annotation_service import SpanIndex
+from .import_service import read_file_text, is_cjk
+
+logger = logging.getLogger(__name__)
+
+# Gazetteer pre-annotation: terms from the project's annotations and uploaded
+# dictionaries are matched with one Aho-Corasick automaton into suggestions.
+
+SOURCE = "gazetteer"
+PAGE_SIZE = 500
+INSERT_CHUNK = 5000
+
+class Automaton:
+    """Aho-Corasick automaton over characters; each pattern carries a label."""
+    def __init__(self, patterns: Iterable[Tuple[str, str]] = ()):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._out: List[Optional[Tuple[int, str]]] = [None]
+        self._fail: List[int] = [0]
+        self._link: List[int] = [0]   # nearest node on the fail chain with an output
+        self.size = 0
+        for term, label in patterns:
+            self._insert(term, label)
+        self._build()
+
+    def _insert(self, term: str, label: str):
+        node = 0
+        for ch in term:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto.append({})
+                self._out.append(None)
+                self._goto[node][ch] = nxt
+            node = nxt
+        if self._out[node] is None:
+            self.size += 1
+        self._out[node] = (len(term), label)
+
+    def _build(self):
+        self._fail = [0] * len(self._goto)
+        self._link = [0] * len(self._goto)
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                f = self._fail[node]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                f = self._goto[f].get(ch, 0)
+                self._fail[child] = f
+                self._link[child] = f if self._out[f] is not None else self._link[f]
+                queue.append(child)
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, int, str]]:
+        """Yields every (start, end, label) occurrence, overlapping ones included."""
+        goto, fail, out, link = self._goto, self._fail, self._out, self._link
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            n = node if out[node] is not None else link[node]
+            while n:
+                length, label = out[n]
+                yield i + 1 - length, i + 1, label
+                n = link[n]
+
+def _is_word(ch: str) -> bool:
+    return ch.isalnum() and not is_cjk(ch)
+
+def select_matches(text: str, matches: Iterable[Tuple[int, int, str]], existing: Optional[SpanIndex] = None,
+                   taken: Sequence[Tuple[int, int, str]] = ()) -> List[Tuple[int, int, str]]:
+    """Keeps leftmost-longest matches on word boundaries that do not clash with existing or taken spans."""
+    n = len(text)
+    taken = set(taken)
+    kept = []
+    last_end = 0
+    for start, end, label in sorted(matches, key=lambda m: (m[0], -m[1])):
+        if start < last_end:
+            continue
+        if start > 0 and _is_word(text[start]) and _is_word(text[start - 1]):
+            continue
+        if end < n and _is_word(text[end - 1]) and _is_word(text[end]):
+            continue
+        if (start, end, label) in taken:
+            continue
+        if existing is not None and existing.overlapping(start, end) is not None:
+            continue
+        kept.append((start, end, label))
+        last_end = end
+    return kept
+
+def parse_dictionary(path: str, default_label: Optional[str] = None, encoding: Optional[str] = None) -> List[Tuple[str, str]]:
+    """Reads "term<TAB>label" lines (or bare terms with default_label), skipping blanks and # comments."""
+    entries = []
+    for line in read_file_text(path, encoding).split("\n"):
+        if not line.strip() or line.lstrip().startswith("#"):
+            continue
+        if "\t" in line:
+            term, label = line.rsplit("\t", 1)
+            entries.append((term.strip(), label.strip()))
+        elif default_label:
+            entries.append((line.strip(), default_label))
+        else:
+            raise ValueError(f"dictionary line without label: {line[:80]}")
+    return entries
+
+def annotation_terms(s, project_id: int) -> Dict[str, str]:
+    """Annotated surface texts of the project mapped to their most frequent label."""
+    term = func.substr(Document.text, Annotation.start + 1, Annotation.end - Annotation.start)
+    q = (select(term, Annotation.label, func.count())
+         .join(Document, Annotation.doc_id == Document.id)
+         .where(Document.project_id == project_id)
+         .group_by(term, Annotation.label))
+    best: Dict[str, Tuple[int, str]] = {}
+    for t, label, n in s.execute(q):
+        if t not in best or n > best[t][0]:
+            best[t] = (n, label)
+    return {t: label for t, (_, label) in best.items()}
+
+def build_terms(s, project_id: int, dictionaries: Sequence[Tuple[str, str]] = (), use_annotations: bool = True,
+                min_length: int = 2) -> Tuple[Dict[str, str], int]:
+    """Returns (term -> label, skipped entry count); dictionary entries win over annotations."""
+    labels = project_service.get_schema(project_id, s).labels
+    terms = annotation_terms(s, project_id) if use_annotations else {}
+    terms.update(dictionaries)
+    kept, skipped = {}, 0
+    for t, label in terms.items():
+        if label in labels and len(t) >= min_length and t == t.strip():
+            kept[t] = label
+        else:
+            skipped += 1
+    return kept, skipped
+
+def pre_annotate(project_id: int, dictionaries: Sequence[Tuple[str, str]] = (), use_annotations: bool = True,
+                 min_length: int = 2, statuses: Sequence[str] = ("pending",)) -> dict:
+    """Replaces the gazetteer suggestions of the project's documents in the given statuses."""
+    init_db()
+    s = get_session()
+    try:
+        schema = project_service.get_schema(project_id, s)
+        terms, skipped = build_terms(s, project_id, dictionaries, use_annotations, min_length)
+        automaton = Automaton(terms.items())
+        result = {"terms": automaton.size, "skipped_terms": skipped, "documents": 0, "suggestions": 0}
+        if not automaton.size:
+            return result
+        after = 0
+        while True:
+            docs = s.execute(
+                select(Document.id, Document.text)
+                .where(Document.project_id == project_id, Document.status.in_(list(statuses)), Document.id > after)
+                .order_by(Document.id).limit(PAGE_SIZE)).all()
+            if not docs:
+                break
+            after = docs[-1][0]
+            ids = [d[0] for d in docs]
+            spans = defaultdict(list)
+            for a_id, doc_id, start, end, label in s.execute(
+                    select(Annotation.id, Annotation.doc_id, Annotation.start, Annotation.end, Annotation.label)
+                    .where(Annotation.doc_id.in_(ids))):
+                spans[doc_id].append((a_id, start, end, label))
+            rows = []
+            for doc_id, text in docs:
+                existing = None if schema.allow_overlap else SpanIndex(0, [sp[:3] for sp in spans[doc_id]])
+                for start, end, label in select_matches(text, automaton.iter_matches(text), existing,
+                                                        [sp[1:] for sp in spans[doc_id]]):
+                    rows.append({"doc_id": doc_id, "start": start, "end": end, "label": label,
+                                 "text": text[start:end], "source": SOURCE})
+            s.execute(delete(Suggestion).where(Suggestion.doc_id.in_(ids), Suggestion.source == SOURCE))
+            conn = s.connection()
+            for i in range(0, len(rows), INSERT_CHUNK):
+                conn.execute(Suggestion.__table__.insert(), rows[i:i + INSERT_CHUNK])
+            s.commit()
+            result["documents"] += len(docs)
+            result["suggestions"] += len(rows)
+        return result
+    finally:
+        s.close()
+
+def list_suggestions(doc_id: int) -> List[SuggestionModel]:
+    init_db()
+    s = get_session()
+    try:
+        rows = s.execute(select(Suggestion).where(Suggestion.doc_id == doc_id).order_by(Suggestion.start, Suggestion.end)).scalars().all()
+        return [SuggestionModel(id=r.id, doc_id=r.doc_id, start=r.start, end=r.end, label=r.label, text=r.text, source=r.source, created_at=r.created_at) for r in rows]
+    finally:
+        s.close()
+
+def _select_ids(s, ids: Optional[List[int]], doc_id: Optional[int]):
+    q = select(Suggestion.id, Suggestion.doc_id, Suggestion.start, Suggestion.end, Suggestion.label, Suggestion.text)
+    if ids is not None:
+        q = q.where(Suggestion.id.in_(ids))
+    elif doc_id is not None:
+        q = q.where(Suggestion.doc_id == doc_id)
+    else:
+        raise ValueError("ids or doc_id required")
+    return s.execute(q.order_by(Suggestion.id)).all()
+
+def accept_suggestions(ids: Optional[List[int]] = None, doc_id: Optional[int] = None) -> dict:
+    """Turns suggestions into spans through the batch API and removes accepted and stale ones."""
+    init_db()
+    s = get_session()
+    try:
+        rows = _select_ids(s, ids, doc_id)
+        texts = dict(s.execute(select(Document.id, Document.text).where(Document.id.in_(list({r.doc_id for r in rows})))).all()) if rows else {}
+    finally:
+        s.close()
+    stale = [r.id for r in rows if texts.get(r.doc_id, "")[r.start:r.end] != r.text]
+    stale_ids = set(stale)
+    live = [r for r in rows if r.id not in stale_ids]
+    res = batch_service.apply_batch([{"op": "add_span", "doc_id": r.doc_id, "start": r.start, "end": r.end, "label": r.label} for r in live], atomic=False)
+    accepted, errors = {}, {}
+    for r, out in zip(live, res["results"]):
+        if out["ok"]:
+            accepted[r.id] = out["id"]
+        else:
+            errors[r.id] = out["error"]
+    reject_suggestions(list(accepted) + stale)
+    return {"accepted": accepted, "stale": stale, "errors": errors, "revisions": res["revisions"]}
+
+def reject_suggestions(ids: Optional[List[int]] = None, doc_id: Optional[int] = None) -> int:
+    init_db()
+    s = get_session()
+    try:
+        q = delete(Suggestion)
+        if ids is not None:
+            if not ids:
+                return 0
+            q = q.where(Suggestion.id.in_(ids))
+        elif doc_id is not None:
+            q = q.where(Suggestion.doc_id == doc_id)
+        else:
+            raise ValueError("ids or doc_id required")
+        n = s.execute(q).rowcount
+        s.commit()
+        return n
+    finally:
+        s.close()
@@ -1,81 +1,471 @@
 import os
-from typing import List, Optional, Tuple
+import re
+import uuid
+import codecs
+import shutil
+import hashlib
+import logging
+import itertools
+import threading
+import unicodedata
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from typing import Iterable, Iterator, List, Optional, Tuple
+from sqlalchemy import select, delete, bindparam
 from ..storage.db import get_session, init_db
-from ..storage.schema import Document, Project
+from ..storage import bulk
+from ..storage.schema import Document, Project, Annotation, Relation
 from ..models import DocumentModel
+from . import revision_service, cache_service
 
-def detect_encoding(path: str) -> str:
+logger = logging.getLogger(__name__)
+
+# Files are decoded and split chunk by chunk and inserted in batches, so
+# memory does not grow with the file size.
+READ_CHUNK_SIZE = 1 << 20
+DETECT_SAMPLE_SIZE = 1 << 20
+IMPORT_BATCH_SIZE = 1000
+PARALLEL_MAX_FILE_SIZE = 64 << 20
+
+# A terminator run plus closing quotes/brackets. A latin period needs
+# whitespace, CJK or the end after it and no abbreviation before it:
+# NUMBERED_ABBREVIATIONS only count before a number, initials before lowercase.
+_TERMINATOR_RE = re.compile(r"(?:([。．！？!?]+)|\.+)[”’\"'」』）)\]】]*")
+_WS_RE = re.compile(r"\s+")
+_ABBREV_RE = re.compile(r"(?:[A-Za-z]\.)*[A-Za-z]+$")
+_OPENERS = "\"'“‘「『（([【"
+ABBREVIATIONS = frozenset(["mr", "mrs", "ms", "dr", "prof", "sr", "jr", "vs", "cf", "approx", "dept", "e.g", "i.e"])
+NUMBERED_ABBREVIATIONS = frozenset(["no", "nos", "fig", "figs", "eq", "eqs", "vol", "vols", "pp", "ref", "refs", "sec", "ch"])
+
+def is_cjk(ch: str) -> bool:
+    """True for CJK characters, which form words without spaces between them."""
+    return "\u3000" <= ch <= "\u9fff" or "\uf900" <= ch <= "\uffef"
+
+def _is_abbreviation(buf: str, pos: int, follow: str) -> bool:
+    # follow is the first character of the next word, "" at the end
+    m = _ABBREV_RE.search(buf, max(0, pos - 16), pos)
+    if not m:
+        return False
+    tok = m.group(0).lower()
+    if tok in ABBREVIATIONS:
+        return True
+    if tok in NUMBERED_ABBREVIATIONS:
+        return follow.isdigit()
+    return "." in tok and all(len(p) == 1 for p in tok.split(".")) and not follow.isupper()
+
+def detect_encoding(path: str, sample_size: int = DETECT_SAMPLE_SIZE) -> str:
     try:
-        from charset_normalizer import from_path
-        res = from_path(path).best()
+        with open(path, "rb") as f:
+            sample = f.read(sample_size)
+        if sample.startswith(codecs.BOM_UTF8):
+            return "utf-8-sig"
+        from charset_normalizer import from_bytes
+        res = from_bytes(sample).best()
         if res and res.encoding:
             return res.encoding
     except Exception:
         pass
     return "utf-8"
 
-def read_file_text(path: str, encoding: Optional[str] = None) -> str:
+def iter_file_text(path: str, encoding: Optional[str] = None, chunk_size: int = READ_CHUNK_SIZE, crlf: Optional[deque] = None) -> Iterator[str]:
+    """Decodes the file chunk by chunk with universal newlines; see SourceOffsets for crlf."""
     enc = encoding or detect_encoding(path)
-    with open(path, "r", encoding=enc, errors="strict") as f:
-        return f.read()
+    decoder = codecs.getincrementaldecoder(enc)(errors="strict")
+    held = ""
+    base = 0
+    with open(path, "rb") as f:
+        while True:
+            raw = f.read(chunk_size)
+            text = held + decoder.decode(raw, final=not raw)
+            if raw and text.endswith("\r"):
+                # The matching \n may start the next chunk
+                text, held = text[:-1], "\r"
+            else:
+                held = ""
+            if text:
+                if crlf is not None:
+                    k = text.find("\r\n")
+                    removed = 0
+                    while k >= 0:
+                        crlf.append(base + k - removed)
+                        removed += 1
+                        k = text.find("\r\n", k + 2)
+                text = text.replace("\r\n", "\n").replace("\r", "\n")
+                base += len(text)
+                yield text
+            if not raw:
+                break
+
+class SourceOffsets:
+    """Maps offsets in newline-normalized text back to the source; offsets must not decrease."""
+    def __init__(self):
+        self.crlf: deque = deque()
+        self._shift = 0
+
+    def map(self, offset: int) -> int:
+        while self.crlf and self.crlf[0] < offset:
+            self.crlf.popleft()
+            self._shift += 1
+        return offset + self._shift
+
+def iter_source_unit_spans(path: str, strategy: str, fixed_length: Optional[int] = None, encoding: Optional[str] = None) -> Iterator[Tuple[int, int, str]]:
+    """Like iter_unit_spans over the file, with offsets into the decoded source file."""
+    offsets = SourceOffsets()
+    for start, end, text in iter_unit_spans(iter_file_text(path, encoding, crlf=offsets.crlf), strategy, fixed_length):
+        yield offsets.map(start), offsets.map(end), text
+
+def read_file_text(path: str, encoding: Optional[str] = None) -> str:
+    return "".join(iter_file_text(path, encoding))
+
+def _sentence_cuts(buf: str, scan: int, final: bool) -> Tuple[List[int], int]:
+    # Returns sentence end positions and where the next scan must resume; a
+    # terminator touching the end of the buffer waits for more input
+    ends = []
+    for m in _TERMINATOR_RE.finditer(buf, scan):
+        if m.end() >= len(buf) and not final:
+            return ends, m.start()
+        if not m.group(1):
+            nxt = buf[m.end()] if m.end() < len(buf) else ""
+            if nxt and not nxt.isspace() and not is_cjk(nxt):
+                continue
+            k = m.end()
+            while k < len(buf) and (buf[k].isspace() or buf[k] in _OPENERS):
+                k += 1
+            if k >= len(buf) and not final:
+                return ends, m.start()
+            if _is_abbreviation(buf, m.start(), buf[k] if k < len(buf) else ""):
+                continue
+        ends.append(m.end())
+    return ends, len(buf)
+
+def _unit(buf: str, base: int, start: int, end: int, strip: bool) -> Optional[Tuple[int, int, str]]:
+    piece = buf[start:end]
+    if not strip:
+        return (base + start, base + end, piece) if piece.strip() else None
+    lead = len(piece) - len(piece.lstrip())
+    trail = len(piece.rstrip())
+    if trail <= lead:
+        return None
+    return base + start + lead, base + start + trail, piece[lead:trail]
+
+def iter_unit_spans(chunks: Iterable[str], strategy: str, fixed_length: Optional[int] = None) -> Iterator[Tuple[int, int, str]]:
+    """Splits a stream of chunks into (start, end, text) units, independent of where chunks were cut."""
+    if strategy not in ("paragraph", "sentence", "length"):
+        # as_is and unknown strategies keep the whole text as one unit
+        text = "".join(chunks)
+        yield 0, len(text), text
+        return
+    n = int(fixed_length or 500)
+    strip = strategy != "length"
+    buf, base, scan = "", 0, 0
+    it = iter(chunks)
+    final = False
+    while not final:
+        chunk = next(it, None)
+        if chunk is None:
+            final = True
+        elif not chunk:
+            continue
+        else:
+            buf += chunk
+        # (unit end, next unit start) pairs, relative to buf
+        cuts = []
+        if strategy == "paragraph":
+            k = buf.find("\n\n", scan)
+            while k >= 0:
+                cuts.append((k, k + 2))
+                k = buf.find("\n\n", k + 2)
+            scan = max(cuts[-1][1] if cuts else 0, len(buf) - 1)
+        elif strategy == "sentence":
+            ends, scan = _sentence_cuts(buf, scan, final)
+            cuts = [(e, e) for e in ends]
+        else:
+            cuts = [(i, i) for i in range(n, len(buf) + 1, n)]
+            scan = len(buf)
+        start = 0
+        for end, nxt in cuts:
+            u = _unit(buf, base, start, end, strip)
+            if u:
+                yield u
+            start = nxt
+        if final:
+            u = _unit(buf, base, start, len(buf), strip)
+            if u:
+                yield u
+            break
+        buf, base, scan = buf[start:], base + start, scan - start
+
+def iter_units(chunks: Iterable[str], strategy: str, fixed_length: Optional[int] = None) -> Iterator[str]:
+    for _, _, text in iter_unit_spans(chunks, strategy, fixed_length):
+        yield text
 
 def split_text(text: str, strategy: str, fixed_length: Optional[int] = None) -> List[str]:
-    t = text.replace("\r\n", "\n")
-    if strategy == "as_is":
-        return [t]
-    if strategy == "paragraph":
-        parts = [p.strip() for p in t.split("\n\n")]
-        return [p for p in parts if p]
-    if strategy == "sentence":
-        import re
-        sents: List[str] = []
-        cur = []
-        for ch in t:
-            cur.append(ch)
-            if re.match(r"[。．\.！？!?]", ch):
-                s = "".join(cur).strip()
-                if s:
-                    sents.append(s)
-                cur = []
-        rest = "".join(cur).strip()
-        if rest:
-            sents.append(rest)
-        return sents
-    if strategy == "length":
-        n = int(fixed_length or 500)
-        out: List[str] = []
-        i = 0
-        while i < len(t):
-            out.append(t[i:i+n])
-            i += n
-        return [p for p in out if p.strip()]
-    return [t]
-
-def import_txt_files(project_id: int, file_paths: List[str], strategy: str = "sentence", fixed_length: Optional[int] = None, encoding: Optional[str] = None) -> List[DocumentModel]:
+    return list(iter_units([text.replace("\r\n", "\n")], strategy, fixed_length))
+
+def _split_file(task: tuple) -> List[Tuple[int, int, str]]:
+    # Runs in a pool worker: decode and split one file, no database access
+    path, strategy, fixed_length, encoding = task
+    return list(iter_source_unit_spans(path, strategy, fixed_length, encoding))
+
+def _iter_file_units(file_paths: List[str], strategy: str, fixed_length: Optional[int], encoding: Optional[str], workers: int) -> Iterator[Tuple[str, Iterable]]:
+    """Yields (path, units) in input order, splitting up to 2 * workers files ahead in a pool."""
+    if workers <= 1 or len(file_paths) < 2:
+        for path in file_paths:
+            yield path, iter_source_unit_spans(path, strategy, fixed_length, encoding)
+        return
+    pool = ProcessPoolExecutor(max_workers=min(workers, len(file_paths)))
+    try:
+        pending: deque = deque()
+        paths = iter(file_paths)
+
+        def submit(path):
+            if os.path.getsize(path) > PARALLEL_MAX_FILE_SIZE:
+                pending.append((path, None))
+            else:
+                pending.append((path, pool.submit(_split_file, (path, strategy, fixed_length, encoding))))
+
+        for path in itertools.islice(paths, 2 * workers):
+            submit(path)
+        while pending:
+            path, fut = pending.popleft()
+            nxt = next(paths, None)
+            if nxt is not None:
+                submit(nxt)
+            if fut is None:
+                yield path, iter_source_unit_spans(path, strategy, fixed_length, encoding)
+            else:
+                yield path, fut.result()
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+DUPLICATE_MODES = ("skip", "update", "report")
+DUPLICATE_REPORT_LIMIT = 1000
+
+def content_hash(text: str) -> str:
+    """sha256 of the NFKC-normalized text with whitespace runs collapsed."""
+    norm = _WS_RE.sub(" ", unicodedata.normalize("NFKC", text)).strip()
+    return hashlib.sha256(norm.encode("utf-8")).hexdigest()
+
+def _flush_batch(s, project_id: int, batch: List[dict], on_duplicate: str, result: dict, inserted: set, seen: set):
+    # Duplicates are resolved for the whole batch with one IN query on the
+    # (project_id, content_hash) unique index. seen holds hashes of this
+    # import that are not in the database yet.
+    for r in batch:
+        r["content_hash"] = content_hash(r["text"])
+    hashes = list({r["content_hash"] for r in batch})
+    q = select(Document.content_hash, Document.id).where(Document.project_id == project_id, Document.content_hash.in_(hashes))
+    existing = dict(s.execute(q).all())
+    new_rows, updates = [], []
+    for r in batch:
+        h = r["content_hash"]
+        dup_id = existing.get(h)
+        if dup_id is None and h not in seen:
+            seen.add(h)
+            new_rows.append(r)
+            continue
+        result["duplicate_count"] += 1
+        if len(result["duplicates"]) < DUPLICATE_REPORT_LIMIT:
+            result["duplicates"].append({"source_file": r["source_file"], "unit_index": r["unit_index"], "doc_id": dup_id})
+        if on_duplicate == "update" and dup_id is not None and dup_id not in inserted:
+            # Same content found at a new location: move the existing
+            # document's provenance, keep its text and annotations
+            updates.append({"b_id": dup_id, "b_source": r["source_file"], "b_unit": r["unit_index"], "b_start": r["start_offset"], "b_end": r["end_offset"]})
+    if on_duplicate == "report":
+        # Dry run: seen keeps every new hash since nothing reaches the database
+        return
+    ids = bulk.insert_documents(s, new_rows)
+    inserted.update(ids)
+    result["inserted_ids"].extend(ids)
+    if updates:
+        t = Document.__table__
+        stmt = (t.update().where(t.c.id == bindparam("b_id"))
+                .values(source_file=bindparam("b_source"), unit_index=bindparam("b_unit"),
+                        start_offset=bindparam("b_start"), end_offset=bindparam("b_end"), revision=t.c.revision + 1))
+        s.connection().execute(stmt, updates)
+        result["updated_ids"].extend(u["b_id"] for u in updates)
+    # Inserted hashes are found by the next batch's query
+    seen.clear()
+
+class ImportCancelled(Exception):
+    pass
+
+def _discard_documents(project_id: int, doc_ids: List[int]):
+    # Undoes a cancelled or failed import: its batches are already committed
+    s = get_session()
+    try:
+        for chunk in bulk.chunks(doc_ids):
+            s.execute(delete(Relation).where(Relation.doc_id.in_(chunk)))
+            s.execute(delete(Annotation).where(Annotation.doc_id.in_(chunk)))
+            s.execute(delete(Document).where(Document.id.in_(chunk)))
+        revision_service.bump_project(s, project_id)
+        s.commit()
+        cache_service.invalidate_span_indexes(doc_ids)
+    finally:
+        s.close()
+
+def import_txt_files(project_id: int, file_paths: List[str], strategy: str = "sentence", fixed_length: Optional[int] = None, encoding: Optional[str] = None, workers: int = 1, job: Optional["ImportJob"] = None, source_names: Optional[List[str]] = None, on_duplicate: str = "skip") -> dict:
+    """Imports text files as documents, committing every IMPORT_BATCH_SIZE units; see DUPLICATE_MODES."""
+    if on_duplicate not in DUPLICATE_MODES:
+        raise ValueError("on_duplicate must be one of: " + ", ".join(DUPLICATE_MODES))
     init_db()
     s = get_session()
     try:
         p = s.get(Project, project_id)
         if not p:
             raise ValueError("project not found")
-        docs: List[DocumentModel] = []
         for path in file_paths:
             if not os.path.isfile(path):
                 raise ValueError("file not found: " + path)
-            text = read_file_text(path, encoding)
-            units = split_text(text, strategy, fixed_length)
-            for idx, u in enumerate(units):
-                d = Document(project_id=project_id, text=u, status="pending", source_file=path, unit_index=idx)
-                s.add(d)
-        s.commit()
-        for path in file_paths:
-            pass
-        q = s.query(Document).filter(Document.project_id == project_id).order_by(Document.id.asc()).all()
-        for d in q:
-            docs.append(DocumentModel(id=d.id, project_id=d.project_id, text=d.text, status=d.status, source_file=d.source_file, unit_index=d.unit_index, created_at=d.created_at))
-        return docs
+        result = {"inserted_ids": [], "updated_ids": [], "duplicate_count": 0, "duplicates": []}
+        if job:
+            job.inserted_ids = result["inserted_ids"]
+        inserted: set = set()
+        seen: set = set()
+        units_processed = 0
+        batch: List[dict] = []
+        names = dict(zip(file_paths, source_names or file_paths))
+
+        def flush():
+            written = len(result["inserted_ids"]) + len(result["updated_ids"])
+            _flush_batch(s, project_id, batch, on_duplicate, result, inserted, seen)
+            if len(result["inserted_ids"]) + len(result["updated_ids"]) > written:
+                revision_service.bump_project(s, project_id)
+                s.commit()
+
+        try:
+            for path, units in _iter_file_units(file_paths, strategy, fixed_length, encoding, workers):
+                source = names[path]
+                if job:
+                    job.current_file = source
+                for idx, (start, end, u) in enumerate(units):
+                    batch.append({"project_id": project_id, "text": u, "status": "pending", "source_file": source, "unit_index": idx,
+                                  "start_offset": start, "end_offset": end})
+                    if len(batch) >= IMPORT_BATCH_SIZE:
+                        flush()
+                        units_processed += len(batch)
+                        batch = []
+                        if job:
+                            job.units_processed = units_processed
+                            if job.cancel_requested:
+                                raise ImportCancelled()
+                if job:
+                    job.files_processed += 1
+            if batch:
+                flush()
+            if job:
+                job.units_processed = units_processed + len(batch)
+        except BaseException:
+            s.rollback()
+            if result["inserted_ids"]:
+                _discard_documents(project_id, result["inserted_ids"])
+            raise
+        return result
+    finally:
+        s.close()
+
+# Background imports. Jobs run one at a time on a single thread, so two
+# imports never compete for the write lock between their batches.
+JOB_HISTORY = 100
+
+class ImportJob:
+    """Progress of one background import; the result is only set once it completed."""
+    def __init__(self, project_id: int, file_paths: List[str], options: dict, cleanup_dir: Optional[str] = None):
+        self.id = uuid.uuid4().hex
+        self.project_id = project_id
+        self.file_paths = list(file_paths)
+        self.options = options
+        self.cleanup_dir = cleanup_dir
+        self.status = "queued"
+        self.error: Optional[str] = None
+        self.files_total = len(file_paths)
+        self.files_processed = 0
+        self.units_processed = 0
+        self.inserted_ids: List[int] = []
+        self.current_file: Optional[str] = None
+        self.result: Optional[dict] = None
+        self.cancel_requested = False
+        self.created_at = datetime.utcnow()
+        self.finished_at: Optional[datetime] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "project_id": self.project_id,
+            "status": self.status,
+            "error": self.error,
+            "files_total": self.files_total,
+            "files_processed": self.files_processed,
+            "units_processed": self.units_processed,
+            "current_file": os.path.basename(self.current_file) if self.current_file else None,
+            "result": self.result if self.status == "completed" else None,
+            "created_at": self.created_at.isoformat(),
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+_jobs: "OrderedDict[str, ImportJob]" = OrderedDict()
+_jobs_lock = threading.Lock()
+_job_runner: Optional[ThreadPoolExecutor] = None
+
+def _run_job(job: ImportJob):
+    try:
+        if job.cancel_requested:
+            job.status = "cancelled"
+            return
+        job.status = "running"
+        job.result = import_txt_files(job.project_id, job.file_paths, job=job, **job.options)
+        job.status = "completed"
+    except ImportCancelled:
+        job.status = "cancelled"
+    except Exception as e:
+        logger.exception("import job %s failed", job.id)
+        job.status = "failed"
+        job.error = str(e)
+    finally:
+        job.current_file = None
+        job.finished_at = datetime.utcnow()
+        if job.cleanup_dir:
+            shutil.rmtree(job.cleanup_dir, ignore_errors=True)
+
+def submit_import_job(project_id: int, file_paths: List[str], strategy: str = "sentence", fixed_length: Optional[int] = None, encoding: Optional[str] = None, workers: int = 1, cleanup_dir: Optional[str] = None, source_names: Optional[List[str]] = None, on_duplicate: str = "skip") -> ImportJob:
+    """Queues an import and returns its job; cleanup_dir is removed when the job ends."""
+    global _job_runner
+    if on_duplicate not in DUPLICATE_MODES:
+        raise ValueError("on_duplicate must be one of: " + ", ".join(DUPLICATE_MODES))
+    init_db()
+    s = get_session()
+    try:
+        if not s.get(Project, project_id):
+            raise ValueError("project not found")
     finally:
         s.close()
+    for path in file_paths:
+        if not os.path.isfile(path):
+            raise ValueError("file not found: " + path)
+    job = ImportJob(project_id, file_paths, {"strategy": strategy, "fixed_length": fixed_length, "encoding": encoding, "workers": workers, "source_names": source_names, "on_duplicate": on_duplicate}, cleanup_dir)
+    with _jobs_lock:
+        _jobs[job.id] = job
+        finished = [k for k, j in _jobs.items() if j.finished_at is not None]
+        for k in finished[:max(0, len(finished) - JOB_HISTORY)]:
+            del _jobs[k]
+        if _job_runner is None:
+            _job_runner = ThreadPoolExecutor(max_workers=1, thread_name_prefix="import-job")
+        _job_runner.submit(_run_job, job)
+    return job
+
+def get_import_job(job_id: str) -> ImportJob:
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+    if job is None:
+        raise ValueError("import job not found")
+    return job
+
+def cancel_import_job(job_id: str) -> ImportJob:
+    """Requests cancellation; a running import stops and deletes its documents at its next batch."""
+    job = get_import_job(job_id)
+    if job.finished_at is None:
+        job.cancel_requested = True
+    return job
 
 def update_document_status(doc_id: int, status: str) -> DocumentModel:
     init_db()
@@ -85,8 +475,10 @@ def update_document_status(doc_id: int, status: str) -> DocumentModel:
         if not d:
             raise ValueError("document not found")
         d.status = status
+        d.revision = d.revision + 1
+        revision_service.bump_project(s, d.project_id)
         s.commit()
         s.refresh(d)
-        return DocumentModel(id=d.id, project_id=d.project_id, text=d.text, status=d.status, source_file=d.source_file, unit_index=d.unit_index, created_at=d.created_at)
+        return DocumentModel(id=d.id, project_id=d.project_id, text=d.text, status=d.status, source_file=d.source_file, unit_index=d.unit_index, start_offset=d.start_offset, end_offset=d.end_offset, revision=d.revision, created_at=d.created_at)
     finally:
         s.close()
\ No newline at end of file
@@ -0,0 +1,123 @@
+import logging
+from typing import Iterable, Iterator
+
+logger = logging.getLogger(__name__)
+
+# Columnar export: one row per document with nested entity and relation
+# columns, handed back as bytes one row group at a time.
+
+PARQUET_ROW_GROUP = 2000
+
+def _pa():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ValueError("parquet export requires pyarrow (pip install pyarrow)")
+    return pyarrow
+
+def require_pyarrow():
+    """Raises ValueError when pyarrow is not installed."""
+    _pa()
+
+def export_schema():
+    pa = _pa()
+    entity = pa.struct([("id", pa.int64()), ("start", pa.int32()), ("end", pa.int32()), ("label", pa.string())])
+    relation = pa.struct([("id", pa.int64()), ("from_id", pa.int64()), ("to_id", pa.int64()), ("type", pa.string())])
+    return pa.schema([
+        ("doc_id", pa.int64()),
+        ("text", pa.string()),
+        ("status", pa.string()),
+        ("unit_index", pa.int32()),
+        ("created_at", pa.timestamp("us")),
+        ("entities", pa.list_(entity)),
+        ("relations", pa.list_(relation)),
+    ])
+
+class _ChunkSink:
+    """Write-only file object that collects what the parquet writer emits."""
+    closed = False
+
+    def __init__(self):
+        self._parts = []
+        self._pos = 0
+
+    def write(self, data) -> int:
+        b = bytes(data)
+        self._parts.append(b)
+        self._pos += len(b)
+        return len(b)
+
+    def tell(self) -> int:
+        return self._pos
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self) -> bytes:
+        out = b"".join(self._parts)
+        self._parts = []
+        return out
+
+def _row_group(pa, schema, docs: list):
+    # Columns are built from flat lists plus list offsets instead of
+    # converting a dict per document
+    cols = {k: [] for k in ("doc_id", "text", "status", "unit_index", "created_at")}
+    ent = {k: [] for k in ("id", "start", "end", "label")}
+    rel = {k: [] for k in ("id", "from_id", "to_id", "type")}
+    ent_off, rel_off = [0], [0]
+    for d, anns, rels in docs:
+        cols["doc_id"].append(d.id)
+        cols["text"].append(d.text)
+        cols["status"].append(d.status)
+        cols["unit_index"].append(d.unit_index)
+        cols["created_at"].append(d.created_at)
+        for a in anns:
+            ent["id"].append(a.id)
+            ent["start"].append(a.start)
+            ent["end"].append(a.end)
+            ent["label"].append(a.label)
+        for r in rels:
+            rel["id"].append(r.id)
+            rel["from_id"].append(r.from_ann_id)
+            rel["to_id"].append(r.to_ann_id)
+            rel["type"].append(r.relation_type)
+        ent_off.append(len(ent["id"]))
+        rel_off.append(len(rel["id"]))
+
+    def nested(name, values, offsets):
+        t = schema.field(name).type
+        struct = pa.StructArray.from_arrays(
+            [pa.array(values[f.name], type=f.type) for f in t.value_type],
+            fields=list(t.value_type))
+        return pa.ListArray.from_arrays(pa.array(offsets, type=pa.int32()), struct, type=t)
+
+    arrays = [pa.array(cols[name], type=schema.field(name).type) for name in cols]
+    arrays.append(nested("entities", ent, ent_off))
+    arrays.append(nested("relations", rel, rel_off))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+def iter_parquet(rows: Iterable, row_group_size: int = PARQUET_ROW_GROUP) -> Iterator[bytes]:
+    """Serializes export rows (document, annotations, relations) to parquet bytes."""
+    pa = _pa()
+    schema = export_schema()
+    sink = _ChunkSink()
+    writer = pa.parquet.ParquetWriter(sink, schema, compression="zstd")
+    try:
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= row_group_size:
+                writer.write_table(_row_group(pa, schema, batch), row_group_size=row_group_size)
+                batch = []
+                chunk = sink.take()
+                if chunk:
+                    yield chunk
+        if batch:
+            writer.write_table(_row_group(pa, schema, batch), row_group_size=row_group_size)
+    finally:
+        writer.close()
+    yield sink.take()
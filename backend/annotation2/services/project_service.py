@@ -7,9 +7,40 @@ from ..storage.db import get_session, init_db
 from ..storage.schema import Project, Document, Annotation, Relation
 from ..models import ProjectModel
 from .record_service import BASE_DATA_DIR
+from . import revision_service, cache_service, export_service
 
 logger = logging.getLogger(__name__)
 
+class ProjectSchema:
+    """What span and relation validation needs from a project, with set lookups."""
+    __slots__ = ("labels", "relation_types", "allow_overlap")
+
+    def __init__(self, labels, relation_types, allow_overlap):
+        self.labels = frozenset(labels or [])
+        self.relation_types = frozenset(relation_types or [])
+        self.allow_overlap = bool(allow_overlap)
+
+def get_schema(project_id: int, s=None) -> ProjectSchema:
+    """Returns the cached schema of a project, loading it on a miss."""
+    schema = cache_service.get_project_schema(project_id)
+    if schema is not None:
+        return schema
+    epoch = cache_service.schema_epoch()
+    own = s is None
+    if own:
+        init_db()
+        s = get_session()
+    try:
+        row = s.execute(select(Project.labels, Project.relation_types, Project.allow_overlap).where(Project.id == project_id)).first()
+    finally:
+        if own:
+            s.close()
+    if row is None:
+        raise ValueError("project not found")
+    schema = ProjectSchema(*row)
+    cache_service.put_project_schema(project_id, schema, epoch)
+    return schema
+
 def create_project(name: str, labels: List[str]) -> ProjectModel:
     init_db()
     s = get_session()
@@ -21,7 +52,7 @@ def create_project(name: str, labels: List[str]) -> ProjectModel:
         s.add(p)
         s.commit()
         s.refresh(p)
-        return ProjectModel(id=p.id, name=p.name, labels=p.labels, relation_types=p.relation_types, allow_overlap=bool(p.allow_overlap), created_at=p.created_at)
+        return ProjectModel(id=p.id, name=p.name, labels=p.labels, relation_types=p.relation_types, allow_overlap=bool(p.allow_overlap), revision=p.revision, created_at=p.created_at)
     finally:
         s.close()
 
@@ -31,7 +62,7 @@ def list_projects() -> List[ProjectModel]:
     try:
         q = select(Project).order_by(Project.id.desc())
         rows = s.execute(q).scalars().all()
-        return [ProjectModel(id=r.id, name=r.name, labels=r.labels, relation_types=r.relation_types, allow_overlap=bool(r.allow_overlap), created_at=r.created_at) for r in rows]
+        return [ProjectModel(id=r.id, name=r.name, labels=r.labels, relation_types=r.relation_types, allow_overlap=bool(r.allow_overlap), revision=r.revision, created_at=r.created_at) for r in rows]
     finally:
         s.close()
 
@@ -45,6 +76,7 @@ def delete_project(project_id: int) -> bool:
             return False
             
         project_name = p.name
+        doc_ids = s.execute(select(Document.id).where(Document.project_id == project_id)).scalars().all()
 
         # Delete relations using subquery
         s.execute(delete(Relation).where(Relation.doc_id.in_(
@@ -62,6 +94,13 @@ def delete_project(project_id: int) -> bool:
         # Delete project
         s.delete(p)
         s.commit()
+        cache_service.invalidate_project(project_id)
+        cache_service.invalidate_project_schema(project_id)
+        cache_service.invalidate_span_indexes(doc_ids)
+        try:
+            export_service.delete_project_exports(project_id)
+        except OSError as e:
+            logger.warning(f"Failed to delete exports of project {project_id}: {e}")
         
         # Try to delete folder
         if project_name:
@@ -88,11 +127,13 @@ def update_labels(project_id: int, labels: List[str]) -> ProjectModel:
     try:
         q = update(Project).where(Project.id == project_id).values(labels=list(labels)).execution_options(synchronize_session="fetch")
         s.execute(q)
+        revision_service.bump_project(s, project_id)
         s.commit()
+        cache_service.invalidate_project_schema(project_id)
         p = s.get(Project, project_id)
         if not p:
             raise ValueError("project not found")
-        return ProjectModel(id=p.id, name=p.name, labels=p.labels, relation_types=p.relation_types, allow_overlap=bool(p.allow_overlap), created_at=p.created_at)
+        return ProjectModel(id=p.id, name=p.name, labels=p.labels, relation_types=p.relation_types, allow_overlap=bool(p.allow_overlap), revision=p.revision, created_at=p.created_at)
     finally:
         s.close()
 
@@ -103,7 +144,7 @@ def get_project(project_id: int) -> ProjectModel:
         p = s.get(Project, project_id)
         if not p:
             raise ValueError("project not found")
-        return ProjectModel(id=p.id, name=p.name, labels=p.labels, relation_types=p.relation_types, allow_overlap=bool(p.allow_overlap), created_at=p.created_at)
+        return ProjectModel(id=p.id, name=p.name, labels=p.labels, relation_types=p.relation_types, allow_overlap=bool(p.allow_overlap), revision=p.revision, created_at=p.created_at)
     finally:
         s.close()
 
@@ -112,11 +153,13 @@ def update_allow_overlap(project_id: int, allow: bool) -> ProjectModel:
     s = get_session()
     try:
         s.execute(update(Project).where(Project.id == project_id).values(allow_overlap=1 if allow else 0).execution_options(synchronize_session="fetch"))
+        revision_service.bump_project(s, project_id)
         s.commit()
+        cache_service.invalidate_project_schema(project_id)
         p = s.get(Project, project_id)
         if not p:
             raise ValueError("project not found")
-        return ProjectModel(id=p.id, name=p.name, labels=p.labels, relation_types=p.relation_types, allow_overlap=bool(p.allow_overlap), created_at=p.created_at)
+        return ProjectModel(id=p.id, name=p.name, labels=p.labels, relation_types=p.relation_types, allow_overlap=bool(p.allow_overlap), revision=p.revision, created_at=p.created_at)
     finally:
         s.close()
 
@@ -125,10 +168,12 @@ def update_relation_types(project_id: int, relation_types: List[str]) -> Project
     s = get_session()
     try:
         s.execute(update(Project).where(Project.id == project_id).values(relation_types=list(relation_types)).execution_options(synchronize_session="fetch"))
+        revision_service.bump_project(s, project_id)
         s.commit()
+        cache_service.invalidate_project_schema(project_id)
         p = s.get(Project, project_id)
         if not p:
             raise ValueError("project not found")
-        return ProjectModel(id=p.id, name=p.name, labels=p.labels, relation_types=p.relation_types, allow_overlap=bool(p.allow_overlap), created_at=p.created_at)
+        return ProjectModel(id=p.id, name=p.name, labels=p.labels, relation_types=p.relation_types, allow_overlap=bool(p.allow_overlap), revision=p.revision, created_at=p.created_at)
     finally:
         s.close()
\ No newline at end of file
@@ -3,8 +3,9 @@ import json
 from typing import Dict, Any
 
 # Base directory for saving annotations
-# We can use a 'data' folder in the project root or backend root
-BASE_DATA_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "..", "data"))
+# We can use a 'data' folder in the project root or backend root;
+# ANNOTATION2_DATA_DIR overrides it (benchmarks, throwaway databases)
+BASE_DATA_DIR = os.path.abspath(os.environ.get("ANNOTATION2_DATA_DIR") or os.path.join(os.path.dirname(__file__), "..", "..", "..", "data"))
 
 if not os.path.exists(BASE_DATA_DIR):
     os.makedirs(BASE_DATA_DIR)
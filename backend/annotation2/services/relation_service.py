@@ -1,8 +1,9 @@
 import logging
 from sqlalchemy import select, delete, update
 from ..storage.db import get_session, init_db
-from ..storage.schema import Relation, Annotation, Document, Project
+from ..storage.schema import Relation, Annotation, Document
 from ..models import RelationModel
+from . import revision_service, project_service
 
 logger = logging.getLogger(__name__)
 
@@ -29,16 +30,15 @@ def add_relation(doc_id: int, from_ann_id: int, to_ann_id: int, relation_type: s
             raise ValueError("annotation not found")
         if a_from.doc_id != doc_id or a_to.doc_id != doc_id:
             raise ValueError("annotation not in document")
-        p = s.get(Project, d.project_id)
-        if not p:
-            raise ValueError("project not found")
-        if relation_type not in p.relation_types:
+        if relation_type not in project_service.get_schema(d.project_id, s).relation_types:
             raise ValueError("relation type not in project")
         q = select(Relation).where(Relation.doc_id == doc_id, Relation.from_ann_id == from_ann_id, Relation.to_ann_id == to_ann_id, Relation.relation_type == relation_type)
         if s.execute(q).scalar_one_or_none():
             raise ValueError("relation exists")
         r = Relation(doc_id=doc_id, from_ann_id=from_ann_id, to_ann_id=to_ann_id, relation_type=relation_type)
         s.add(r)
+        revision_service.bump_documents(s, [doc_id])
+        revision_service.bump_project(s, d.project_id)
         s.commit()
         s.refresh(r)
         return RelationModel(id=r.id, doc_id=r.doc_id, from_ann_id=r.from_ann_id, to_ann_id=r.to_ann_id, relation_type=r.relation_type, created_at=r.created_at)
@@ -55,12 +55,11 @@ def update_relation(rel_id: int, relation_type: str):
         d = s.get(Document, r0.doc_id)
         if not d:
             raise ValueError("document not found")
-        p = s.get(Project, d.project_id)
-        if not p:
-            raise ValueError("project not found")
-        if relation_type not in p.relation_types:
+        if relation_type not in project_service.get_schema(d.project_id, s).relation_types:
             raise ValueError("relation type not in project")
         s.execute(update(Relation).where(Relation.id == rel_id).values(relation_type=relation_type).execution_options(synchronize_session="fetch"))
+        revision_service.bump_documents(s, [d.id])
+        revision_service.bump_project(s, d.project_id)
         s.commit()
         r = s.get(Relation, rel_id)
         return RelationModel(id=r.id, doc_id=r.doc_id, from_ann_id=r.from_ann_id, to_ann_id=r.to_ann_id, relation_type=r.relation_type, created_at=r.created_at)
@@ -71,8 +70,12 @@ def delete_relation(rel_id: int):
     init_db()
     s = get_session()
     try:
+        d = s.execute(select(Document).join(Relation, Relation.doc_id == Document.id).where(Relation.id == rel_id)).scalar_one_or_none()
         q = delete(Relation).where(Relation.id == rel_id)
         res = s.execute(q)
+        if d is not None:
+            revision_service.bump_documents(s, [d.id])
+            revision_service.bump_project(s, d.project_id)
         s.commit()
         return res.rowcount > 0
     finally:
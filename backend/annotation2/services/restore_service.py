@@ -0,0 +1,213 @@
+import io
+import gzip
+import json
+import logging
+import hashlib
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from sqlalchemy.orm.attributes import flag_modified
+from ..storage.db import get_session, init_db
+from ..storage.schema import Project
+from ..storage import bulk
+from . import revision_service, cache_service
+
+logger = logging.getLogger(__name__)
+
+# Loads our exports and record_service logs back into a project. Records are
+# normalized to {"text", "status", "unit_index", "spans": [(key, start, end,
+# label)], "relations": [(from_key, to_key, type)]} with the file's span keys.
+
+RESTORE_FORMATS = ("json_v2", "jsonl", "record")
+RESTORE_BATCH_DOCS = 2000
+READ_CHUNK_CHARS = 1 << 20
+
+def _open_text(path: str):
+    if path.endswith(".gz"):
+        return io.TextIOWrapper(gzip.open(path, "rb"), encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+def detect_format(path: str) -> str:
+    name = path[:-3] if path.endswith(".gz") else path
+    if name.endswith(".json"):
+        return "json_v2"
+    with _open_text(path) as f:
+        for line in f:
+            if line.strip():
+                obj = json.loads(line)
+                return "record" if "spans" in obj or "meta" in obj else "jsonl"
+    return "jsonl"
+
+def _iter_json_array(f, key: str) -> Iterator[Any]:
+    # Streams the elements of the top-level array under key without loading
+    # the whole document; elements are decoded one at a time with raw_decode
+    decoder = json.JSONDecoder()
+    buf = ""
+    marker = f'"{key}"'
+    eof = False
+    while True:
+        k = buf.find(marker)
+        if k >= 0:
+            b = buf.find("[", k + len(marker))
+            if b >= 0:
+                buf = buf[b + 1:]
+                break
+        if eof:
+            raise ValueError(f"no {key} array in file")
+        chunk = f.read(READ_CHUNK_CHARS)
+        eof = not chunk
+        buf += chunk
+    pos = 0
+    while True:
+        while pos < len(buf) and buf[pos] in " \t\r\n,":
+            pos += 1
+        if pos < len(buf) and buf[pos] == "]":
+            return
+        try:
+            obj, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise ValueError("truncated json file")
+            chunk = f.read(READ_CHUNK_CHARS)
+            eof = not chunk
+            buf = buf[pos:] + chunk
+            pos = 0
+            continue
+        yield obj
+        pos = end
+
+def _from_json_v2(obj: dict) -> dict:
+    ann = obj.get("annotations") or {}
+    unit = None
+    parts = str(obj.get("text_id", "")).rsplit("_unit_", 1)
+    if len(parts) == 2 and parts[1].isdigit():
+        unit = int(parts[1])
+    return {
+        "text": obj["original_text"],
+        "status": (obj.get("metadata") or {}).get("status") or "pending",
+        "unit_index": unit,
+        "spans": [(e["id"], e["start_offset"], e["end_offset"], e["label"]) for e in ann.get("entities", [])],
+        "relations": [(r["from_entity_id"], r["to_entity_id"], r["relation_type"]) for r in ann.get("relations", [])],
+    }
+
+def _from_jsonl(obj: dict) -> dict:
+    # Relations reference entities by their position in the list
+    return {
+        "text": obj["text"],
+        "status": obj.get("status") or "pending",
+        "unit_index": None,
+        "spans": [(i, e["start"], e["end"], e["label"]) for i, e in enumerate(obj.get("entities", []))],
+        "relations": [(r["from_entity"], r["to_entity"], r["relation"]) for r in obj.get("relations", [])],
+    }
+
+def _from_record(obj: dict) -> dict:
+    # A record is written when the annotator saves a finished document
+    return {
+        "text": obj["text"],
+        "status": "completed",
+        "unit_index": None,
+        "spans": [(sp["id"], sp["start"], sp["end"], sp["label"]) for sp in obj.get("spans", [])],
+        "relations": [(r["fromId"], r["toId"], r["type"]) for r in obj.get("relations", [])],
+    }
+
+def _record_key(obj: dict) -> str:
+    doc_id = obj.get("id")
+    if isinstance(doc_id, int) and doc_id > 0:
+        return f"id:{doc_id}"
+    return "text:" + hashlib.sha1(obj.get("text", "").encode("utf-8")).hexdigest()
+
+def iter_records(path: str, fmt: str = "auto") -> Iterator[dict]:
+    """Yields normalized documents from an export or record log."""
+    f = detect_format(path) if fmt == "auto" else fmt
+    if f not in RESTORE_FORMATS:
+        raise ValueError("unsupported format")
+    if f == "json_v2":
+        with _open_text(path) as fi:
+            for obj in _iter_json_array(fi, "documents"):
+                yield _from_json_v2(obj)
+        return
+    if f == "jsonl":
+        with _open_text(path) as fi:
+            for line in fi:
+                if line.strip():
+                    yield _from_jsonl(json.loads(line))
+        return
+    # The record log is append-only and a document is re-recorded on every
+    # save: a first pass finds the last line of each document, the second
+    # pass yields only those, in log order
+    last: Dict[str, int] = {}
+    with _open_text(path) as fi:
+        for n, line in enumerate(fi):
+            if line.strip():
+                last[_record_key(json.loads(line))] = n
+    keep = set(last.values())
+    del last
+    with _open_text(path) as fi:
+        for n, line in enumerate(fi):
+            if n in keep:
+                yield _from_record(json.loads(line))
+
+def _flush(s, project_id: int, docs: List[dict], result: dict, labels: set, rel_types: set):
+    doc_ids = bulk.insert_documents(s, [{"project_id": project_id, "text": d["text"], "status": d["status"], "unit_index": d["unit_index"]} for d in docs])
+    span_rows, span_keys = [], []
+    for doc_id, d in zip(doc_ids, docs):
+        n = len(d["text"])
+        for key, start, end, label in d["spans"]:
+            if not (0 <= start < end <= n) or label not in labels:
+                result["skipped_spans"] += 1
+                continue
+            span_rows.append({"doc_id": doc_id, "start": start, "end": end, "label": label})
+            span_keys.append((doc_id, key))
+    id_map = dict(zip(span_keys, bulk.insert_annotations(s, span_rows)))
+    rel_rows = []
+    for doc_id, d in zip(doc_ids, docs):
+        for fk, tk, rtype in d["relations"]:
+            fid, tid = id_map.get((doc_id, fk)), id_map.get((doc_id, tk))
+            if fid is None or tid is None or rtype not in rel_types:
+                result["skipped_relations"] += 1
+                continue
+            rel_rows.append({"doc_id": doc_id, "from_ann_id": fid, "to_ann_id": tid, "relation_type": rtype})
+    bulk.insert_relations(s, rel_rows)
+    result["documents"] += len(doc_ids)
+    result["spans"] += len(span_rows)
+    result["relations"] += len(rel_rows)
+    result["first_doc_id"] = result["first_doc_id"] or (doc_ids[0] if doc_ids else None)
+    result["last_doc_id"] = doc_ids[-1] if doc_ids else result["last_doc_id"]
+
+def restore_file(project_id: int, path: str, fmt: str = "auto", extend_schema: bool = True) -> dict:
+    """Bulk-loads an export or record log into the project; invalid spans and relations are skipped and counted."""
+    init_db()
+    s = get_session()
+    try:
+        p = s.get(Project, project_id)
+        if not p:
+            raise ValueError("project not found")
+        labels, rel_types = list(p.labels or []), list(p.relation_types or [])
+        known_labels, known_types = set(labels), set(rel_types)
+        result = {"documents": 0, "spans": 0, "relations": 0, "skipped_spans": 0, "skipped_relations": 0,
+                  "first_doc_id": None, "last_doc_id": None, "new_labels": [], "new_relation_types": []}
+        batch: List[dict] = []
+        for d in iter_records(path, fmt):
+            if extend_schema:
+                for _, _, _, label in d["spans"]:
+                    if label not in known_labels:
+                        known_labels.add(label)
+                        result["new_labels"].append(label)
+                for _, _, rtype in d["relations"]:
+                    if rtype not in known_types:
+                        known_types.add(rtype)
+                        result["new_relation_types"].append(rtype)
+            batch.append(d)
+            if len(batch) >= RESTORE_BATCH_DOCS:
+                _flush(s, project_id, batch, result, known_labels, known_types)
+                batch = []
+        _flush(s, project_id, batch, result, known_labels, known_types)
+        if result["new_labels"] or result["new_relation_types"]:
+            p.labels = labels + result["new_labels"]
+            p.relation_types = rel_types + result["new_relation_types"]
+            flag_modified(p, "labels")
+            flag_modified(p, "relation_types")
+        revision_service.bump_project(s, project_id)
+        s.commit()
+        cache_service.invalidate_project_schema(project_id)
+        return result
+    finally:
+        s.close()
@@ -0,0 +1,65 @@
+import logging
+from typing import Dict, Iterable, List, Optional
+from sqlalchemy import select, update, bindparam
+from ..storage.schema import Project, Document
+from . import cache_service
+
+logger = logging.getLogger(__name__)
+
+# Optimistic concurrency helpers. They take the caller's session and never
+# commit, so the revision bump lands in the same transaction as the write.
+
+class RevisionConflict(Exception):
+    """Raised when a write was based on stale document revisions."""
+    def __init__(self, conflicts: List[Dict[str, int]]):
+        super().__init__("stale documents: " + ", ".join(str(c["id"]) for c in conflicts))
+        self.conflicts = conflicts
+
+def bump_project(s, project_id: int):
+    s.execute(update(Project).where(Project.id == project_id).values(revision=Project.revision + 1).execution_options(synchronize_session=False))
+    # Every writer passes through here, so cached snapshots are dropped with it
+    cache_service.invalidate_project(project_id)
+
+def project_revision(s, project_id: int) -> int:
+    return s.execute(select(Project.revision).where(Project.id == project_id)).scalar()
+
+def version_tag(created_at, revision: int) -> str:
+    # sqlite hands the id of a deleted row to the next insert, and a new row
+    # starts again at revision 0, so (id, revision) alone can name two
+    # different projects or documents. Caches, ETags and export watermarks
+    # therefore also compare created_at, which a reused id does not share.
+    created = created_at.strftime("%Y%m%d%H%M%S%f") if created_at else "0"
+    return f"{created}-r{revision}"
+
+def project_version(s, project_id: int) -> Optional[str]:
+    row = s.execute(select(Project.created_at, Project.revision).where(Project.id == project_id)).first()
+    return version_tag(*row) if row else None
+
+def bump_documents(s, doc_ids: Iterable[int]):
+    ids = list(doc_ids)
+    for i in range(0, len(ids), 5000):
+        chunk = ids[i:i + 5000]
+        s.execute(update(Document).where(Document.id.in_(chunk)).values(revision=Document.revision + 1).execution_options(synchronize_session=False))
+
+def current_revisions(s, ids: List[int]) -> Dict[int, int]:
+    current = {}
+    for i in range(0, len(ids), 5000):
+        q = select(Document.id, Document.revision).where(Document.id.in_(ids[i:i + 5000]))
+        current.update(dict(s.execute(q).all()))
+    return current
+
+def check_and_bump_documents(s, expected: Dict[int, int]):
+    """Compare-and-set on document revisions; raises RevisionConflict, the caller rolls back."""
+    if not expected:
+        return
+    current = current_revisions(s, list(expected))
+    conflicts = [{"id": k, "expected": v, "revision": current.get(k)} for k, v in expected.items() if current.get(k) != v]
+    if conflicts:
+        raise RevisionConflict(conflicts)
+    t = Document.__table__
+    stmt = t.update().where(t.c.id == bindparam("b_id"), t.c.revision == bindparam("b_rev")).values(revision=t.c.revision + 1)
+    res = s.connection().execute(stmt, [{"b_id": k, "b_rev": v} for k, v in expected.items()])
+    if res.rowcount != len(expected):
+        # Another writer slipped in between the check and the update
+        current = current_revisions(s, list(expected))
+        raise RevisionConflict([{"id": k, "expected": v, "revision": current.get(k)} for k, v in expected.items()])
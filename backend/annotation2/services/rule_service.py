@@ -0,0 +1,216 @@
+import re
+import logging
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from sqlalchemy import select, update
+from ..storage.db import get_session, init_db, init_worker
+from ..storage.schema import Project, Document, Annotation
+from ..storage import bulk
+from . import revision_service, project_service
+from .annotation_service import SpanIndex
+
+logger = logging.getLogger(__name__)
+
+# Rule-based bulk labeling with ordered regex rules {"pattern", "label",
+# "group"}; on conflicts the leftmost, longest, earliest rule wins.
+# User patterns can backtrack exponentially (ReDoS). normalize_rules caps
+# their length and rejects nested unbounded repeats like (a+)+; other slow
+# shapes such as (a|a)* still pass.
+
+RULE_PAGE_SIZE = 2000
+MAX_RULES = 200
+MAX_PATTERN_LENGTH = 500
+
+_POSSESSIVE_REPEAT = getattr(sre_parse, "POSSESSIVE_REPEAT", None)
+_ATOMIC_GROUP = getattr(sre_parse, "ATOMIC_GROUP", None)
+
+def _nested_repeat(items, in_repeat: bool = False) -> bool:
+    # True if an unbounded greedy/lazy repeat sits inside another one
+    for op, av in items:
+        if op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+            unbounded = av[1] == sre_parse.MAXREPEAT
+            if (unbounded and in_repeat) or _nested_repeat(av[2], in_repeat or unbounded):
+                return True
+        elif op == _POSSESSIVE_REPEAT or op == _ATOMIC_GROUP:
+            if _nested_repeat(av[2] if op == _POSSESSIVE_REPEAT else av):
+                return True
+        elif op == sre_parse.SUBPATTERN:
+            if _nested_repeat(av[3], in_repeat):
+                return True
+        elif op == sre_parse.BRANCH:
+            if any(_nested_repeat(b, in_repeat) for b in av[1]):
+                return True
+        elif op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+            if _nested_repeat(av[1], in_repeat):
+                return True
+        elif op == sre_parse.GROUPREF_EXISTS:
+            if any(_nested_repeat(b, in_repeat) for b in av[1:] if b):
+                return True
+    return False
+
+def _compile(rules: Sequence[Dict[str, Any]]) -> List[Tuple[re.Pattern, Any, str]]:
+    compiled = []
+    for i, r in enumerate(rules):
+        try:
+            rx = re.compile(r["pattern"])
+        except re.error as e:
+            raise ValueError(f"rule {i}: invalid pattern: {e}")
+        group = r.get("group", 0)
+        if (isinstance(group, int) and not 0 <= group <= rx.groups) or (isinstance(group, str) and group not in rx.groupindex):
+            raise ValueError(f"rule {i}: unknown group {group!r}")
+        compiled.append((rx, group, r["label"]))
+    return compiled
+
+def normalize_rules(rules: Any, labels) -> List[Dict[str, Any]]:
+    """Validates rules against the project's labels; raises ValueError."""
+    if not isinstance(rules, list):
+        raise ValueError("rules must be a list")
+    if len(rules) > MAX_RULES:
+        raise ValueError(f"at most {MAX_RULES} rules per project")
+    out = []
+    for i, r in enumerate(rules):
+        if not isinstance(r, dict) or not isinstance(r.get("pattern"), str) or not r["pattern"]:
+            raise ValueError(f"rule {i}: pattern required")
+        if len(r["pattern"]) > MAX_PATTERN_LENGTH:
+            raise ValueError(f"rule {i}: pattern longer than {MAX_PATTERN_LENGTH} characters")
+        if r.get("label") not in labels:
+            raise ValueError(f"rule {i}: label not in project")
+        group = r.get("group", 0)
+        if not isinstance(group, (int, str)) or isinstance(group, bool):
+            raise ValueError(f"rule {i}: group must be a number or a name")
+        out.append({"pattern": r["pattern"], "label": r["label"], "group": group})
+    for i, (rx, _, _) in enumerate(_compile(out)):
+        if _nested_repeat(sre_parse.parse(rx.pattern, rx.flags)):
+            raise ValueError(f"rule {i}: nested repeats like (a+)+ can take exponential time")
+    return out
+
+def get_rules(project_id: int) -> List[Dict[str, Any]]:
+    init_db()
+    s = get_session()
+    try:
+        rules = s.execute(select(Project.label_rules).where(Project.id == project_id)).scalar_one_or_none()
+        if rules is None:
+            raise ValueError("project not found")
+        return rules
+    finally:
+        s.close()
+
+def set_rules(project_id: int, rules: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    init_db()
+    s = get_session()
+    try:
+        rules = normalize_rules(rules, project_service.get_schema(project_id, s).labels)
+        s.execute(update(Project).where(Project.id == project_id).values(label_rules=rules))
+        revision_service.bump_project(s, project_id)
+        s.commit()
+        return rules
+    finally:
+        s.close()
+
+def _match_docs(task) -> List[Tuple[int, List[Tuple[int, int, int]]]]:
+    # Runs in pool workers: rules travel as plain dicts and are compiled
+    # once per page of documents
+    rules, docs = task
+    compiled = _compile(rules)
+    out = []
+    for doc_id, text in docs:
+        found = []
+        for k, (rx, group, _) in enumerate(compiled):
+            for m in rx.finditer(text):
+                start, end = m.span(group)
+                if start < end:
+                    found.append((start, end, k))
+        if found:
+            out.append((doc_id, found))
+    return out
+
+def select_rule_matches(found: List[Tuple[int, int, int]], labels: Sequence[str], spans: Sequence[Tuple[int, int, int, str]],
+                        allow_overlap: bool) -> List[Tuple[int, int, int]]:
+    """Picks the matches of one document to turn into spans."""
+    found = sorted(found, key=lambda m: (m[0], -m[1], m[2]))
+    taken = {(sp[1], sp[2], sp[3]) for sp in spans}
+    kept, seen = [], set()
+    if allow_overlap:
+        for start, end, k in found:
+            key = (start, end, labels[k])
+            if key not in taken and key not in seen:
+                seen.add(key)
+                kept.append((start, end, k))
+        return kept
+    index = SpanIndex(0, [sp[:3] for sp in spans])
+    last_end = 0
+    for start, end, k in found:
+        if start < last_end or index.overlapping(start, end) is not None:
+            continue
+        kept.append((start, end, k))
+        last_end = end
+    return kept
+
+def apply_rules(project_id: int, rules: Optional[List[Dict[str, Any]]] = None, dry_run: bool = False, workers: int = 1) -> dict:
+    """Runs the rules over all documents and creates the spans page by page; dry_run only counts."""
+    init_db()
+    s = get_session()
+    pool = None
+    try:
+        schema = project_service.get_schema(project_id, s)
+        if rules is None:
+            rules = s.execute(select(Project.label_rules).where(Project.id == project_id)).scalar_one()
+        rules = normalize_rules(rules, schema.labels)
+        labels = [r["label"] for r in rules]
+        result = {"dry_run": dry_run, "documents": 0, "matched_documents": 0, "spans": 0,
+                  "rules": [{"pattern": r["pattern"], "label": r["label"], "matches": 0, "spans": 0} for r in rules]}
+        if not rules:
+            return result
+        if workers > 1:
+            pool = ProcessPoolExecutor(max_workers=workers, initializer=init_worker)
+        after = 0
+        while True:
+            docs = s.execute(
+                select(Document.id, Document.text)
+                .where(Document.project_id == project_id, Document.id > after)
+                .order_by(Document.id).limit(RULE_PAGE_SIZE)).all()
+            if not docs:
+                break
+            after = docs[-1][0]
+            result["documents"] += len(docs)
+            docs = [tuple(d) for d in docs]
+            if pool is not None:
+                step = -(-len(docs) // workers)
+                tasks = [(rules, docs[i:i + step]) for i in range(0, len(docs), step)]
+                matched = [m for part in pool.map(_match_docs, tasks) for m in part]
+            else:
+                matched = _match_docs((rules, docs))
+            if not matched:
+                continue
+            spans = defaultdict(list)
+            for row in s.execute(select(Annotation.id, Annotation.doc_id, Annotation.start, Annotation.end, Annotation.label)
+                                 .where(Annotation.doc_id.in_([doc_id for doc_id, _ in matched]))):
+                spans[row[1]].append((row[0], row[2], row[3], row[4]))
+            rows, touched = [], []
+            for doc_id, found in matched:
+                for _, _, k in found:
+                    result["rules"][k]["matches"] += 1
+                kept = select_rule_matches(found, labels, spans[doc_id], schema.allow_overlap)
+                for start, end, k in kept:
+                    result["rules"][k]["spans"] += 1
+                    rows.append({"doc_id": doc_id, "start": start, "end": end, "label": labels[k]})
+                if kept:
+                    touched.append(doc_id)
+            result["matched_documents"] += len(touched)
+            result["spans"] += len(rows)
+            if dry_run or not rows:
+                continue
+            bulk.insert_annotations(s, rows)
+            revision_service.bump_documents(s, touched)
+            revision_service.bump_project(s, project_id)
+            s.commit()
+        return result
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+        s.close()
@@ -1,9 +1,13 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterator, Tuple
 import os
+import json
 from sqlalchemy import select, delete
-from ..storage.db import get_session, init_db
+from ..storage.db import get_session, init_db, begin_read
+from ..storage import bulk
 from ..storage.schema import Project, Document, Annotation, Relation
 from .record_service import BASE_DATA_DIR
+from . import revision_service, cache_service, project_service
+from .annotation_service import SpanIndex
 
 def get_project_id_by_name(name: str) -> Optional[int]:
     init_db()
@@ -47,67 +51,162 @@ def create_project(name: str, labels: List[str] = None, relation_types: List[str
     finally:
         s.close()
 
-def load_project_data(project_id: int) -> Dict[str, Any]:
+LOAD_PAGE_SIZE = 500
+# Largest page a client may ask for; bounds the IN lists of the span/relation loads
+MAX_LOAD_LIMIT = 1000
+
+def _project_header(p: Project) -> Dict[str, Any]:
+    return {
+        "name": p.name,
+        "labels": p.labels,
+        "relation_types": p.relation_types,
+        "revision": p.revision
+    }
+
+def _load_documents_page(s, project_id: int, after_id: int, limit: int) -> List[Dict[str, Any]]:
+    # One query each for documents, annotations and relations of the page,
+    # grouped by doc_id in Python instead of two queries per document.
+    q_docs = select(Document).where(Document.project_id == project_id, Document.id > after_id).order_by(Document.id.asc()).limit(limit)
+    docs = s.execute(q_docs).scalars().all()
+    if not docs:
+        return []
+    doc_ids = [d.id for d in docs]
+
+    spans_by_doc: Dict[int, list] = {i: [] for i in doc_ids}
+    ann_ids = set()
+    q_anns = select(Annotation.id, Annotation.doc_id, Annotation.start, Annotation.end, Annotation.label).where(Annotation.doc_id.in_(doc_ids)).order_by(Annotation.doc_id.asc(), Annotation.id.asc())
+    for a_id, a_doc, a_start, a_end, a_label in s.execute(q_anns):
+        spans_by_doc[a_doc].append({
+            "id": a_id,
+            "start": a_start,
+            "end": a_end,
+            "label": a_label
+        })
+        ann_ids.add(a_id)
+
+    rels_by_doc: Dict[int, list] = {i: [] for i in doc_ids}
+    q_rels = select(Relation.id, Relation.doc_id, Relation.from_ann_id, Relation.to_ann_id, Relation.relation_type).where(Relation.doc_id.in_(doc_ids)).order_by(Relation.doc_id.asc(), Relation.id.asc())
+    for r_id, r_doc, r_from, r_to, r_type in s.execute(q_rels):
+        if r_from in ann_ids and r_to in ann_ids:
+            rels_by_doc[r_doc].append({
+                "id": r_id,
+                "fromId": r_from,
+                "toId": r_to,
+                "type": r_type
+            })
+
+    return [{
+        "id": d.id,
+        "text": d.text,
+        "status": d.status,
+        "revision": d.revision,
+        "spans": spans_by_doc[d.id],
+        "relations": rels_by_doc[d.id]
+    } for d in docs]
+
+def load_project_data(project_id: int, cursor: Optional[int] = None, limit: Optional[int] = None) -> Dict[str, Any]:
+    """Loads a project with its documents, all of them or one page after cursor when limit is set."""
     init_db()
     s = get_session()
     try:
+        begin_read(s)
         p = s.get(Project, project_id)
         if not p:
             return None
-            
-        q_docs = select(Document).where(Document.project_id == project_id).order_by(Document.id.asc())
-        docs = s.execute(q_docs).scalars().all()
-        
-        doc_list = []
-        for d in docs:
-            # Fetch annotations
-            q_anns = select(Annotation).where(Annotation.doc_id == d.id).order_by(Annotation.id.asc())
-            anns = s.execute(q_anns).scalars().all()
-            
-            spans = []
-            ann_id_map = {} 
-            
-            for a in anns:
-                spans.append({
-                    "id": a.id,
-                    "start": a.start,
-                    "end": a.end,
-                    "label": a.label
-                })
-                ann_id_map[a.id] = a.id
-
-            # Fetch relations
-            q_rels = select(Relation).where(Relation.doc_id == d.id).order_by(Relation.id.asc())
-            rels = s.execute(q_rels).scalars().all()
-            
-            relations = []
-            for r in rels:
-                if r.from_ann_id in ann_id_map and r.to_ann_id in ann_id_map:
-                    relations.append({
-                        "fromId": r.from_ann_id,
-                        "toId": r.to_ann_id,
-                        "type": r.relation_type
-                    })
-            
-            doc_list.append({
-                "id": d.id,
-                "text": d.text,
-                "status": d.status,
-                "spans": spans,
-                "relations": relations
-            })
-            
-        return {
-            "project": {
-                "name": p.name,
-                "labels": p.labels,
-                "relation_types": p.relation_types
-            },
-            "documents": doc_list
-        }
+
+        after_id = cursor or 0
+        if limit is not None:
+            limit = max(1, min(limit, MAX_LOAD_LIMIT))
+            doc_list = _load_documents_page(s, project_id, after_id, limit)
+            next_cursor = doc_list[-1]["id"] if len(doc_list) == limit else None
+            return {
+                "project": _project_header(p),
+                "documents": doc_list,
+                "next_cursor": next_cursor
+            }
+
+        return _load_all(s, p, after_id)
+    finally:
+        s.close()
+
+def _load_all(s, p: Project, after_id: int = 0) -> Dict[str, Any]:
+    doc_list = []
+    while True:
+        page = _load_documents_page(s, p.id, after_id, LOAD_PAGE_SIZE)
+        doc_list.extend(page)
+        if len(page) < LOAD_PAGE_SIZE:
+            break
+        after_id = page[-1]["id"]
+
+    return {
+        "project": _project_header(p),
+        "documents": doc_list
+    }
+
+def get_project_revision(project_id: int) -> Optional[int]:
+    init_db()
+    s = get_session()
+    try:
+        return revision_service.project_revision(s, project_id)
     finally:
         s.close()
 
+def get_project_version(project_id: int) -> Optional[str]:
+    init_db()
+    s = get_session()
+    try:
+        return revision_service.project_version(s, project_id)
+    finally:
+        s.close()
+
+def get_project_snapshot(project_id: int) -> Optional[Tuple[str, bytes]]:
+    """Returns (version, serialized JSON) of the full project, cached per version."""
+    version = get_project_version(project_id)
+    if version is None:
+        return None
+    payload = cache_service.get_snapshot(project_id, version)
+    if payload is not None:
+        return version, payload
+    s = get_session()
+    try:
+        # Version and pages come from one read snapshot
+        begin_read(s)
+        p = s.get(Project, project_id)
+        if not p:
+            return None
+        version = revision_service.version_tag(p.created_at, p.revision)
+        data = _load_all(s, p)
+    finally:
+        s.close()
+    payload = json.dumps(data, ensure_ascii=False, default=str).encode("utf-8")
+    cache_service.put_snapshot(project_id, version, payload)
+    return version, payload
+
+def iter_project_data(project_id: int, cursor: Optional[int] = None, page_size: int = LOAD_PAGE_SIZE) -> Iterator[Dict[str, Any]]:
+    """Yields {"project"} then one {"document"} per document; raises ValueError if the project is missing."""
+    init_db()
+    s = get_session()
+    begin_read(s)
+    p = s.get(Project, project_id)
+    if not p:
+        s.close()
+        raise ValueError("project not found")
+
+    def gen():
+        try:
+            yield {"project": _project_header(p)}
+            after_id = cursor or 0
+            while True:
+                page = _load_documents_page(s, project_id, after_id, page_size)
+                for d in page:
+                    yield {"document": d}
+                if len(page) < page_size:
+                    break
+                after_id = page[-1]["id"]
+        finally:
+            s.close()
+    return gen()
+
 def save_project_data(project_id: int, data: Dict[str, Any]):
     init_db()
     s = get_session()
@@ -126,50 +225,238 @@ def save_project_data(project_id: int, data: Dict[str, Any]):
         
         # Handle documents
         saved_docs = []
+        doc_ids = []
         if "documents" in data:
+            doc_entries = []
+            wanted = [d.get("id") for d in data["documents"] if d.get("id") and d.get("id") > 0]
+            existing = {}
+            for chunk in bulk.chunks(wanted):
+                q = select(Document).where(Document.project_id == project_id, Document.id.in_(chunk))
+                existing.update({d.id: d for d in s.execute(q).scalars()})
+            # Documents sent with the revision they were loaded at are checked
+            # against the stored one; a mismatch aborts the whole save.
+            expected = {d["id"]: d["revision"] for d in data["documents"] if d.get("id") in existing and d.get("revision") is not None}
+            revision_service.check_and_bump_documents(s, expected)
+            revision_service.bump_documents(s, [i for i in existing if i not in expected])
             for d_data in data["documents"]:
-                doc_id = d_data.get("id")
-                doc = None
-                
-                if doc_id and doc_id > 0:
-                    doc = s.get(Document, doc_id)
-                    if doc and doc.project_id == project_id:
-                        doc.text = d_data.get("text", doc.text)
-                        doc.status = d_data.get("status", doc.status)
-                    else:
-                        # ID mismatch or not found, create new
-                        doc = Document(project_id=project_id, text=d_data["text"], status=d_data.get("status", "pending"))
-                        s.add(doc)
-                        s.flush()
+                doc = existing.get(d_data.get("id"))
+                if doc is not None:
+                    if d_data.get("text", doc.text) != doc.text:
+                        # An edited text no longer matches its import hash
+                        doc.text = d_data["text"]
+                        doc.content_hash = None
+                    doc.status = d_data.get("status", doc.status)
                 else:
-                    # Create new
+                    # Unknown, foreign or missing id: create new
                     doc = Document(project_id=project_id, text=d_data["text"], status=d_data.get("status", "pending"))
                     s.add(doc)
-                    s.flush() 
-                
-                # Replace annotations
-                s.execute(delete(Relation).where(Relation.doc_id == doc.id))
-                s.execute(delete(Annotation).where(Annotation.doc_id == doc.id))
-                
-                frontend_id_map = {}
-                
+                doc_entries.append((d_data, doc))
+            # One flush assigns ids to every new document
+            s.flush()
+
+            # Replace annotations
+            doc_ids = list({doc.id for _, doc in doc_entries})
+            for chunk in bulk.chunks(doc_ids):
+                s.execute(delete(Relation).where(Relation.doc_id.in_(chunk)))
+                s.execute(delete(Annotation).where(Annotation.doc_id.in_(chunk)))
+
+            span_rows = []
+            span_keys = []
+            for i, (d_data, doc) in enumerate(doc_entries):
                 for sp in d_data.get("spans", []):
-                    a = Annotation(doc_id=doc.id, start=sp["start"], end=sp["end"], label=sp["label"])
-                    s.add(a)
-                    s.flush()
-                    frontend_id_map[sp["id"]] = a.id
-                
+                    span_rows.append({"doc_id": doc.id, "start": sp["start"], "end": sp["end"], "label": sp["label"]})
+                    span_keys.append((i, sp["id"]))
+            frontend_id_maps = [{} for _ in doc_entries]
+            for (i, fid), new_id in zip(span_keys, bulk.insert_annotations(s, span_rows)):
+                frontend_id_maps[i][fid] = new_id
+
+            rel_rows = []
+            for i, (d_data, doc) in enumerate(doc_entries):
+                id_map = frontend_id_maps[i]
                 for rel in d_data.get("relations", []):
                     fid = rel.get("fromId")
                     tid = rel.get("toId")
-                    if fid in frontend_id_map and tid in frontend_id_map:
-                        r = Relation(doc_id=doc.id, from_ann_id=frontend_id_map[fid], to_ann_id=frontend_id_map[tid], relation_type=rel["type"])
-                        s.add(r)
-                
-                saved_docs.append({"id": doc.id, "status": "saved"})
+                    if fid in id_map and tid in id_map:
+                        rel_rows.append({"doc_id": doc.id, "from_ann_id": id_map[fid], "to_ann_id": id_map[tid], "relation_type": rel["type"]})
+            bulk.insert_relations(s, rel_rows)
+
+            revisions = revision_service.current_revisions(s, doc_ids)
+            saved_docs = [{"id": doc.id, "status": "saved", "revision": revisions.get(doc.id)} for _, doc in doc_entries]
+
+        revision_service.bump_project(s, project_id)
+        project_revision = revision_service.project_revision(s, project_id)
+        s.commit()
+        cache_service.invalidate_project_schema(project_id)
+        cache_service.invalidate_span_indexes(doc_ids)
+        return {"status": "ok", "documents": saved_docs, "project_revision": project_revision}
+    except Exception as e:
+        s.rollback()
+        raise e
+    finally:
+        s.close()
+
+def _delta_ops(section: Any) -> Dict[str, list]:
+    section = section or {}
+    return {k: list(section.get(k) or []) for k in ("added", "updated", "removed")}
+
+def _check_span(doc: Document, start: int, end: int, label: str, schema, index: Optional[SpanIndex], exclude: Optional[int] = None):
+    if not isinstance(start, int) or not isinstance(end, int) or start < 0 or start >= end or end > len(doc.text):
+        raise ValueError(f"invalid span {start}-{end} in document {doc.id}")
+    if label not in schema.labels:
+        raise ValueError(f"label {label!r} not in project")
+    if index is not None and index.overlapping(start, end, exclude) is not None:
+        raise ValueError(f"span {start}-{end} overlaps another span in document {doc.id}")
+
+def _span_ref(ref: Any, span_id_map: Dict[str, int]) -> int:
+    # Strings are client refs of spans added in this delta, ints are database ids
+    if isinstance(ref, str):
+        if ref not in span_id_map:
+            raise ValueError(f"unknown span ref {ref!r}")
+        return span_id_map[ref]
+    if isinstance(ref, int) and not isinstance(ref, bool):
+        return ref
+    raise ValueError(f"invalid span reference {ref!r}")
+
+# A delta document is {"id"?, "text"?, "status"?, "spans": {"added", "updated",
+# "removed"}, "relations": {...}}; added spans may carry a string "id" ref that
+# added relations use, and span_id_map in the result maps refs to database ids.
+def apply_project_delta(project_id: int, data: Dict[str, Any]) -> Dict[str, Any]:
+    """Applies per-document span and relation operations in one transaction."""
+    init_db()
+    s = get_session()
+    try:
+        p = s.get(Project, project_id)
+        if not p:
+            raise ValueError("project not found")
+
+        if "project" in data:
+            pm = data["project"]
+            if "name" in pm: p.name = pm["name"]
+            if "labels" in pm: p.labels = pm["labels"]
+            if "relation_types" in pm: p.relation_types = pm["relation_types"]
+            # Validate against the schema as updated by this delta
+            schema = project_service.ProjectSchema(p.labels, p.relation_types, p.allow_overlap)
+        else:
+            schema = project_service.get_schema(project_id, s)
+
+        expected = {d["id"]: d["revision"] for d in data.get("documents") or [] if d.get("id") and d.get("id") > 0 and d.get("revision") is not None}
+        revision_service.check_and_bump_documents(s, expected)
+
+        removed_docs = [int(i) for i in data.get("removed_documents") or []]
+        if removed_docs:
+            s.execute(delete(Document).where(Document.project_id == project_id, Document.id.in_(removed_docs)))
+
+        saved_docs = []
+        for d_data in data.get("documents") or []:
+            doc_id = d_data.get("id")
+            created = False
+            if doc_id and doc_id > 0:
+                doc = s.get(Document, doc_id)
+                if not doc or doc.project_id != project_id:
+                    raise ValueError(f"document {doc_id} not in project")
+                if "text" in d_data and d_data["text"] != doc.text:
+                    doc.text = d_data["text"]
+                    doc.content_hash = None
+                if "status" in d_data: doc.status = d_data["status"]
+                if doc_id not in expected:
+                    revision_service.bump_documents(s, [doc_id])
+            else:
+                if "text" not in d_data:
+                    raise ValueError("new document requires text")
+                doc = Document(project_id=project_id, text=d_data["text"], status=d_data.get("status", "pending"))
+                s.add(doc)
+                s.flush()
+                created = True
+
+            spans = _delta_ops(d_data.get("spans"))
+            rels = _delta_ops(d_data.get("relations"))
+
+            if rels["removed"]:
+                s.execute(delete(Relation).where(Relation.doc_id == doc.id, Relation.id.in_(rels["removed"])))
+            if spans["removed"]:
+                # Relations attached to removed spans go with them via ON DELETE CASCADE
+                s.execute(delete(Annotation).where(Annotation.doc_id == doc.id, Annotation.id.in_(spans["removed"])))
+
+            index = None
+            if not schema.allow_overlap and (spans["updated"] or spans["added"]):
+                s.flush()
+                index = SpanIndex(0, s.execute(select(Annotation.id, Annotation.start, Annotation.end).where(Annotation.doc_id == doc.id)).all())
+
+            if spans["updated"]:
+                ids = [sp["id"] for sp in spans["updated"]]
+                existing = {a.id: a for a in s.execute(select(Annotation).where(Annotation.doc_id == doc.id, Annotation.id.in_(ids))).scalars()}
+                for sp in spans["updated"]:
+                    a = existing.get(sp["id"])
+                    if a is None:
+                        raise ValueError(f"span {sp['id']} not in document {doc.id}")
+                    start, end, label = sp.get("start", a.start), sp.get("end", a.end), sp.get("label", a.label)
+                    _check_span(doc, start, end, label, schema, index, exclude=a.id)
+                    if index is not None:
+                        index.remove(a.id)
+                        index.add(a.id, start, end)
+                    a.start, a.end, a.label = start, end, label
+
+            refs = set()
+            for n, sp in enumerate(spans["added"]):
+                ref = sp.get("id")
+                if ref is not None and (not isinstance(ref, str) or ref in refs):
+                    raise ValueError(f"added span id must be a new string client ref, got {ref!r}")
+                refs.add(ref)
+                _check_span(doc, sp["start"], sp["end"], sp["label"], schema, index)
+                if index is not None:
+                    index.add(("new", n), sp["start"], sp["end"])
+            span_id_map = {}
+            rows = [{"doc_id": doc.id, "start": sp["start"], "end": sp["end"], "label": sp["label"]} for sp in spans["added"]]
+            for sp, new_id in zip(spans["added"], bulk.insert_annotations(s, rows)):
+                if sp.get("id") is not None:
+                    span_id_map[sp["id"]] = new_id
+
+            if rels["updated"]:
+                ids = [r["id"] for r in rels["updated"]]
+                existing = {r.id: r for r in s.execute(select(Relation).where(Relation.doc_id == doc.id, Relation.id.in_(ids))).scalars()}
+                for rd in rels["updated"]:
+                    r = existing.get(rd["id"])
+                    if r is None:
+                        raise ValueError(f"relation {rd['id']} not in document {doc.id}")
+                    rtype = rd.get("type", r.relation_type)
+                    if rtype not in schema.relation_types:
+                        raise ValueError(f"relation type {rtype!r} not in project")
+                    r.relation_type = rtype
+
+            relation_ids = []
+            if rels["added"]:
+                endpoints = set()
+                pending = []
+                for rd in rels["added"]:
+                    if rd.get("type") not in schema.relation_types:
+                        raise ValueError(f"relation type {rd.get('type')!r} not in project")
+                    fid = _span_ref(rd.get("fromId"), span_id_map)
+                    tid = _span_ref(rd.get("toId"), span_id_map)
+                    endpoints.update([fid, tid])
+                    pending.append(Relation(doc_id=doc.id, from_ann_id=fid, to_ann_id=tid, relation_type=rd["type"]))
+                q = select(Annotation.id).where(Annotation.doc_id == doc.id, Annotation.id.in_(list(endpoints)))
+                known = set(s.execute(q).scalars())
+                missing = endpoints - known
+                if missing:
+                    raise ValueError(f"relation endpoints not in document {doc.id}: {sorted(map(str, missing))}")
+                s.add_all(pending)
+                s.flush()
+                relation_ids = [r.id for r in pending]
+
+            saved_docs.append({
+                "id": doc.id,
+                "status": "created" if created else "saved",
+                "revision": revision_service.current_revisions(s, [doc.id]).get(doc.id),
+                "span_id_map": span_id_map,
+                "relation_ids": relation_ids,
+            })
 
+        revision_service.bump_project(s, project_id)
+        project_revision = revision_service.project_revision(s, project_id)
         s.commit()
-        return {"status": "ok", "documents": saved_docs}
+        cache_service.invalidate_project_schema(project_id)
+        cache_service.invalidate_span_indexes(removed_docs)
+        return {"status": "ok", "documents": saved_docs, "removed_documents": removed_docs, "project_revision": project_revision}
     except Exception as e:
         s.rollback()
         raise e
@@ -202,8 +489,11 @@ def clear_project(project_id: int) -> bool:
         p.labels = []
         p.relation_types = []
         s.add(p)
+        revision_service.bump_project(s, project_id)
 
         s.commit()
+        cache_service.invalidate_project_schema(project_id)
+        cache_service.invalidate_span_indexes(doc_ids)
         return True
     finally:
         s.close()
@@ -212,10 +502,14 @@ def delete_document(doc_id: int) -> bool:
     init_db()
     s = get_session()
     try:
+        project_id = s.execute(select(Document.project_id).where(Document.id == doc_id)).scalar()
         s.execute(delete(Relation).where(Relation.doc_id == doc_id))
         s.execute(delete(Annotation).where(Annotation.doc_id == doc_id))
         s.execute(delete(Document).where(Document.id == doc_id))
+        if project_id is not None:
+            revision_service.bump_project(s, project_id)
         s.commit()
+        cache_service.invalidate_span_indexes([doc_id])
         return True
     finally:
         s.close()
@@ -0,0 +1,113 @@
+import re
+import logging
+from typing import List, Tuple, Sequence
+
+logger = logging.getLogger(__name__)
+
+# BIO tagging for NER exports from a per-character array of covering span
+# indexes (-1 for none), compared vectorized instead of looping in Python.
+
+# Runs of non-CJK word characters form one token; every other non-space
+# character (CJK ideographs, punctuation) is a token of its own.
+TOKEN_RE = re.compile(r"[^\W\u3400-\u9fff\uf900-\ufaff]+|\S")
+
+TOKENIZATIONS = ("char", "token")
+
+def _np():
+    try:
+        import numpy as np
+    except ImportError:
+        raise ValueError("bio/conll export requires numpy (pip install numpy)")
+    return np
+
+def select_spans(length: int, spans: Sequence[Tuple[int, int, str]], allow_overlap: bool) -> List[Tuple[int, int, str]]:
+    """Keeps a non-overlapping subset for BIO: longest first if overlap is allowed, else earliest."""
+    ordered = sorted(spans, key=lambda sp: (sp[0], sp[1]))
+    if all(ordered[i][1] <= ordered[i + 1][0] for i in range(len(ordered) - 1)):
+        return ordered
+    np = _np()
+    if allow_overlap:
+        ordered.sort(key=lambda sp: (-(sp[1] - sp[0]), sp[0], sp[1]))
+    occupied = np.zeros(length, dtype=bool)
+    kept = []
+    for sp in ordered:
+        start, end = max(sp[0], 0), min(sp[1], length)
+        if occupied[start:end].any():
+            continue
+        occupied[start:end] = True
+        kept.append(sp)
+    kept.sort()
+    return kept
+
+def span_index_array(length: int, spans: Sequence[Tuple[int, int, str]]):
+    np = _np()
+    ent = np.full(length, -1, dtype=np.int32)
+    for i, (start, end, _) in enumerate(spans):
+        ent[max(start, 0):min(end, length)] = i
+    return ent
+
+def _bio_codes(ent, label_ids):
+    # 0 = O, 2k+1 = B-label_k, 2k+2 = I-label_k
+    np = _np()
+    prev = np.empty_like(ent)
+    prev[0:1] = -1
+    prev[1:] = ent[:-1]
+    inside = ent >= 0
+    lab = np.where(inside, label_ids[np.maximum(ent, 0)], 0)
+    codes = np.zeros(ent.shape[0], dtype=np.int32)
+    codes[inside] = 2 * lab[inside] + 1 + (ent[inside] == prev[inside])
+    return codes
+
+class BioTagger:
+    """Converts (text, spans) to BIO tags; label tag strings are shared across documents."""
+    def __init__(self, labels: Sequence[str], allow_overlap: bool, tokenization: str = "char"):
+        if tokenization not in TOKENIZATIONS:
+            raise ValueError("unsupported tokenization")
+        _np()
+        self.allow_overlap = bool(allow_overlap)
+        self.tokenization = tokenization
+        self._label_index = {}
+        self._tag_strings = ["O"]
+        self._tag_array = None
+        for l in labels:
+            self._label(l)
+
+    def _label(self, label: str) -> int:
+        k = self._label_index.get(label)
+        if k is None:
+            k = len(self._label_index)
+            self._label_index[label] = k
+            self._tag_strings.extend(["B-" + label, "I-" + label])
+        return k
+
+    def tag(self, text: str, spans: Sequence[Tuple[int, int, str]]) -> Tuple[List[str], List[str]]:
+        """Returns (tokens, tags) for one document."""
+        np = _np()
+        kept = select_spans(len(text), spans, self.allow_overlap)
+        label_ids = np.array([self._label(sp[2]) for sp in kept] or [0], dtype=np.int32)
+        ent = span_index_array(len(text), kept)
+        if self.tokenization == "char":
+            tokens = list(text)
+        else:
+            # findall/split run in C; offsets come from cumulative lengths
+            tokens = TOKEN_RE.findall(text)
+            if not tokens:
+                return [], []
+            gaps = TOKEN_RE.split(text)
+            n = len(tokens)
+            tok_len = np.fromiter(map(len, tokens), dtype=np.int64, count=n)
+            gap_len = np.fromiter(map(len, gaps), dtype=np.int64, count=n + 1)
+            starts = np.cumsum(gap_len[:n]) + np.concatenate(([0], np.cumsum(tok_len[:-1])))
+            # A token takes the span covering any of its characters: reduce
+            # over [start, end) pairs and keep every other result
+            bounds = np.empty(2 * n, dtype=np.int64)
+            bounds[0::2] = starts
+            bounds[1::2] = starts + tok_len
+            padded = np.append(ent, np.int32(-1))
+            ent = np.maximum.reduceat(padded, bounds)[0::2]
+        if ent.shape[0] == 0:
+            return tokens, []
+        codes = _bio_codes(ent, label_ids)
+        if self._tag_array is None or len(self._tag_array) != len(self._tag_strings):
+            self._tag_array = np.array(self._tag_strings, dtype=object)
+        return tokens, self._tag_array[codes].tolist()
@@ -0,0 +1,37 @@
+from datetime import datetime
+from typing import Any, Dict, List
+from sqlalchemy import select, insert, func
+from .schema import Document, Annotation, Relation
+from .db import begin_write
+
+# Bulk row inserts with ids pre-allocated above max(id), read inside the
+# write transaction (begin_write). Helpers take the caller's session and never commit.
+
+BULK_CHUNK_SIZE = 5000
+
+def chunks(items: list, size: int = BULK_CHUNK_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def _insert(s, model, rows: List[Dict[str, Any]], created_at: bool = True) -> List[int]:
+    if not rows:
+        return []
+    begin_write(s)
+    first = (s.execute(select(func.max(model.id))).scalar() or 0) + 1
+    ids = list(range(first, first + len(rows)))
+    now = datetime.utcnow()
+    params = [dict(r, id=i, created_at=now) if created_at else dict(r, id=i) for r, i in zip(rows, ids)]
+    conn = s.connection()
+    for chunk in chunks(params):
+        conn.execute(insert(model.__table__), chunk)
+    return ids
+
+def insert_documents(s, rows: List[Dict[str, Any]]) -> List[int]:
+    # created_at is left to the column default, like ORM-created documents
+    return _insert(s, Document, rows, created_at=False)
+
+def insert_annotations(s, rows: List[Dict[str, Any]]) -> List[int]:
+    return _insert(s, Annotation, rows)
+
+def insert_relations(s, rows: List[Dict[str, Any]]) -> List[int]:
+    return _insert(s, Relation, rows)
@@ -1,6 +1,7 @@
 import os
 import logging
-from sqlalchemy import create_engine
+import threading
+from sqlalchemy import create_engine, event, inspect
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
 
 logger = logging.getLogger(__name__)
@@ -13,14 +14,123 @@ def _db_path():
     p = os.path.join(d, "annotation2.db")
     return p
 
-DATABASE_URL = "sqlite:///" + _db_path()
-engine = create_engine(DATABASE_URL, future=True, connect_args={"check_same_thread": False})
+# Storage profiles, selected with ANNOTATION2_STORAGE_PROFILE.
+# "default" is the plain SQLite engine, "tuned" enables WAL and sizes the pool
+# so concurrent annotators do not stall on "database is locked".
+STORAGE_PROFILES = {
+    "default": {
+        "pragmas": {
+            "foreign_keys": "ON",
+        },
+        "pool_size": None,
+        "max_overflow": None,
+    },
+    "tuned": {
+        "pragmas": {
+            "foreign_keys": "ON",
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "busy_timeout": 5000,
+            "mmap_size": 268435456,
+            "cache_size": -65536,
+            "temp_store": "MEMORY",
+        },
+        "pool_size": 8,
+        "max_overflow": 16,
+    },
+}
+
+def _env_int(name, default):
+    v = os.environ.get(name)
+    if v is None or v == "":
+        return default
+    return int(v)
+
+def load_storage_config():
+    profile_name = os.environ.get("ANNOTATION2_STORAGE_PROFILE", "tuned")
+    if profile_name not in STORAGE_PROFILES:
+        raise ValueError("unknown storage profile: " + profile_name)
+    profile = STORAGE_PROFILES[profile_name]
+    pragmas = dict(profile["pragmas"])
+    for key in ("busy_timeout", "mmap_size", "cache_size"):
+        if key in pragmas:
+            pragmas[key] = _env_int("ANNOTATION2_SQLITE_" + key.upper(), pragmas[key])
+    return {
+        "profile": profile_name,
+        "url": os.environ.get("ANNOTATION2_DATABASE_URL", "sqlite:///" + _db_path()),
+        "pragmas": pragmas,
+        "pool_size": _env_int("ANNOTATION2_DB_POOL_SIZE", profile["pool_size"]),
+        "max_overflow": _env_int("ANNOTATION2_DB_MAX_OVERFLOW", profile["max_overflow"]),
+    }
+
+def _make_engine(cfg):
+    kwargs = {"future": True}
+    is_sqlite = cfg["url"].startswith("sqlite")
+    if is_sqlite:
+        kwargs["connect_args"] = {"check_same_thread": False}
+    is_memory = cfg["url"] in ("sqlite://", "sqlite:///:memory:")
+    if cfg["pool_size"] is not None and not is_memory:
+        kwargs["pool_size"] = cfg["pool_size"]
+        kwargs["max_overflow"] = cfg["max_overflow"] or 0
+        kwargs["pool_pre_ping"] = False
+    eng = create_engine(cfg["url"], **kwargs)
+    if is_sqlite and cfg["pragmas"]:
+        pragmas = cfg["pragmas"]
+
+        @event.listens_for(eng, "connect")
+        def _apply_pragmas(dbapi_conn, conn_record):
+            cur = dbapi_conn.cursor()
+            try:
+                for k, v in pragmas.items():
+                    cur.execute(f"PRAGMA {k}={v}")
+            finally:
+                cur.close()
+    return eng
+
+STORAGE_CONFIG = load_storage_config()
+DATABASE_URL = STORAGE_CONFIG["url"]
+engine = _make_engine(STORAGE_CONFIG)
 SessionLocal = sessionmaker(bind=engine, expire_on_commit=False, autoflush=False, autocommit=False)
 
+_init_lock = threading.Lock()
+_initialized = False
+
 def init_db():
-    from . import schema
-    Base.metadata.create_all(bind=engine)
+    # Schema creation runs once per process; later calls are a flag check.
+    global _initialized
+    if _initialized:
+        return True
+    with _init_lock:
+        if _initialized:
+            return True
+        from . import schema, migrations
+        fresh = not inspect(engine).has_table("documents")
+        Base.metadata.create_all(bind=engine)
+        migrations.upgrade(engine, fresh=fresh)
+        _initialized = True
+        logger.info("storage initialized (profile=%s)", STORAGE_CONFIG["profile"])
     return True
 
 def get_session():
-    return SessionLocal()
\ No newline at end of file
+    return SessionLocal()
+
+def begin_read(s):
+    # pysqlite only opens a transaction before DML, so consecutive SELECTs
+    # may each see a different commit. An explicit BEGIN makes them share
+    # one snapshot until the session commits, rolls back or closes.
+    _begin(s, "BEGIN")
+
+def begin_write(s):
+    # Takes the write lock before anything is read, so values read next
+    # (e.g. max(id)) cannot be changed by another writer before our insert
+    _begin(s, "BEGIN IMMEDIATE")
+
+def _begin(s, stmt: str):
+    conn = s.connection()
+    if engine.dialect.name == "sqlite" and not conn.connection.dbapi_connection.in_transaction:
+        conn.exec_driver_sql(stmt)
+
+def init_worker():
+    # ProcessPoolExecutor initializer: forked workers must not share the
+    # parent's pooled sqlite connections
+    engine.dispose(close=False)
@@ -0,0 +1,219 @@
+import re
+import hashlib
+import logging
+import unicodedata
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Versioned, in-place upgrades for existing annotation2.db files.
+# create_all never alters existing tables, so every schema change after the
+# baseline has to be shipped here as well as in schema.py. Migrations are
+# frozen SQL: they must not depend on the current ORM models.
+
+VERSION_TABLE = "schema_version"
+
+def _m001_composite_indexes(cur):
+    cur.execute('CREATE INDEX IF NOT EXISTS ix_annotations_doc_id_start_end ON annotations (doc_id, start, "end")')
+    cur.execute("CREATE INDEX IF NOT EXISTS ix_documents_project_id_id ON documents (project_id, id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS ix_documents_project_id_status ON documents (project_id, status)")
+    cur.execute("CREATE INDEX IF NOT EXISTS ix_relations_doc_id_from_to_type ON relations (doc_id, from_ann_id, to_ann_id, relation_type)")
+
+def _rebuild_table(cur, name, create_sql, columns, indexes):
+    cols = ", ".join(columns)
+    cur.execute(create_sql.format(name=name + "_new"))
+    cur.execute(f"INSERT INTO {name}_new ({cols}) SELECT {cols} FROM {name}")
+    cur.execute(f"DROP TABLE {name}")
+    cur.execute(f"ALTER TABLE {name}_new RENAME TO {name}")
+    for sql in indexes:
+        cur.execute(sql)
+
+def _m002_cascade_foreign_keys(cur):
+    # Rows orphaned by earlier non-cascading deletes would violate the new
+    # constraints; they were never visible through the API, so drop them.
+    orphans = {}
+    cur.execute("DELETE FROM documents WHERE project_id NOT IN (SELECT id FROM projects)")
+    orphans["documents"] = cur.rowcount
+    cur.execute("DELETE FROM annotations WHERE doc_id NOT IN (SELECT id FROM documents)")
+    orphans["annotations"] = cur.rowcount
+    cur.execute(
+        "DELETE FROM relations WHERE doc_id NOT IN (SELECT id FROM documents) "
+        "OR from_ann_id NOT IN (SELECT id FROM annotations) "
+        "OR to_ann_id NOT IN (SELECT id FROM annotations)"
+    )
+    orphans["relations"] = cur.rowcount
+    for table, n in orphans.items():
+        if n > 0:
+            logger.warning("migration 2 deleted %d orphaned %s rows", n, table)
+    _rebuild_table(cur, "documents", """
+        CREATE TABLE {name} (
+            id INTEGER NOT NULL,
+            project_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            status VARCHAR(32) NOT NULL,
+            source_file VARCHAR(1024),
+            unit_index INTEGER,
+            created_at DATETIME,
+            PRIMARY KEY (id),
+            FOREIGN KEY(project_id) REFERENCES projects (id) ON DELETE CASCADE
+        )""",
+        ["id", "project_id", "text", "status", "source_file", "unit_index", "created_at"],
+        [
+            "CREATE INDEX ix_documents_project_id ON documents (project_id)",
+            "CREATE INDEX ix_documents_project_id_id ON documents (project_id, id)",
+            "CREATE INDEX ix_documents_project_id_status ON documents (project_id, status)",
+        ])
+    _rebuild_table(cur, "annotations", """
+        CREATE TABLE {name} (
+            id INTEGER NOT NULL,
+            doc_id INTEGER NOT NULL,
+            start INTEGER NOT NULL,
+            "end" INTEGER NOT NULL,
+            label VARCHAR(64) NOT NULL,
+            created_at DATETIME,
+            PRIMARY KEY (id),
+            FOREIGN KEY(doc_id) REFERENCES documents (id) ON DELETE CASCADE
+        )""",
+        ["id", "doc_id", "start", '"end"', "label", "created_at"],
+        [
+            "CREATE INDEX ix_annotations_doc_id ON annotations (doc_id)",
+            'CREATE INDEX ix_annotations_doc_id_start_end ON annotations (doc_id, start, "end")',
+        ])
+    _rebuild_table(cur, "relations", """
+        CREATE TABLE {name} (
+            id INTEGER NOT NULL,
+            doc_id INTEGER NOT NULL,
+            from_ann_id INTEGER NOT NULL,
+            to_ann_id INTEGER NOT NULL,
+            relation_type VARCHAR(64) NOT NULL,
+            created_at DATETIME,
+            PRIMARY KEY (id),
+            FOREIGN KEY(doc_id) REFERENCES documents (id) ON DELETE CASCADE,
+            FOREIGN KEY(from_ann_id) REFERENCES annotations (id) ON DELETE CASCADE,
+            FOREIGN KEY(to_ann_id) REFERENCES annotations (id) ON DELETE CASCADE
+        )""",
+        ["id", "doc_id", "from_ann_id", "to_ann_id", "relation_type", "created_at"],
+        [
+            "CREATE INDEX ix_relations_doc_id ON relations (doc_id)",
+            "CREATE INDEX ix_relations_from_ann_id ON relations (from_ann_id)",
+            "CREATE INDEX ix_relations_to_ann_id ON relations (to_ann_id)",
+            "CREATE INDEX ix_relations_doc_id_from_to_type ON relations (doc_id, from_ann_id, to_ann_id, relation_type)",
+        ])
+
+def _m003_revisions(cur):
+    cur.execute("ALTER TABLE projects ADD COLUMN revision INTEGER NOT NULL DEFAULT 0")
+    cur.execute("ALTER TABLE documents ADD COLUMN revision INTEGER NOT NULL DEFAULT 0")
+
+def _m004_document_offsets(cur):
+    cur.execute("ALTER TABLE documents ADD COLUMN start_offset INTEGER")
+    cur.execute("ALTER TABLE documents ADD COLUMN end_offset INTEGER")
+
+def _m005_content_hash(cur):
+    # Frozen copy of import_service.content_hash. Only imported documents
+    # are hashed, and only the first of each duplicate group per project.
+    def content_hash(text):
+        norm = re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text)).strip()
+        return hashlib.sha256(norm.encode("utf-8")).hexdigest()
+    cur.execute("ALTER TABLE documents ADD COLUMN content_hash VARCHAR(64)")
+    seen = set()
+    updates = []
+    for doc_id, project_id, text in cur.execute("SELECT id, project_id, text FROM documents WHERE source_file IS NOT NULL ORDER BY id").fetchall():
+        h = content_hash(text)
+        if (project_id, h) not in seen:
+            seen.add((project_id, h))
+            updates.append((h, doc_id))
+    cur.executemany("UPDATE documents SET content_hash = ? WHERE id = ?", updates)
+    cur.execute("CREATE UNIQUE INDEX ux_documents_project_id_content_hash ON documents (project_id, content_hash)")
+
+def _m006_suggestions(cur):
+    # create_all runs first and already builds new tables
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS suggestions (
+            id INTEGER NOT NULL,
+            doc_id INTEGER NOT NULL,
+            start INTEGER NOT NULL,
+            "end" INTEGER NOT NULL,
+            label VARCHAR(64) NOT NULL,
+            text TEXT NOT NULL,
+            source VARCHAR(32) NOT NULL,
+            created_at DATETIME,
+            PRIMARY KEY (id),
+            FOREIGN KEY(doc_id) REFERENCES documents (id) ON DELETE CASCADE
+        )""")
+    cur.execute('CREATE INDEX IF NOT EXISTS ix_suggestions_doc_id_start_end ON suggestions (doc_id, start, "end")')
+
+def _m007_label_rules(cur):
+    cur.execute("ALTER TABLE projects ADD COLUMN label_rules JSON NOT NULL DEFAULT '[]'")
+
+MIGRATIONS = [
+    (1, "composite indexes for hot queries", _m001_composite_indexes),
+    (2, "on delete cascade foreign keys", _m002_cascade_foreign_keys),
+    (3, "project and document revisions", _m003_revisions),
+    (4, "document source offsets", _m004_document_offsets),
+    (5, "document content hash", _m005_content_hash),
+    (6, "span suggestions", _m006_suggestions),
+    (7, "project label rules", _m007_label_rules),
+]
+
+HEAD = MIGRATIONS[-1][0]
+
+def _ensure_version_table(cur):
+    cur.execute(
+        f"CREATE TABLE IF NOT EXISTS {VERSION_TABLE} ("
+        "version INTEGER NOT NULL PRIMARY KEY, "
+        "name VARCHAR(255) NOT NULL, "
+        "applied_at DATETIME NOT NULL)"
+    )
+
+def _current_version(cur) -> int:
+    row = cur.execute(f"SELECT MAX(version) FROM {VERSION_TABLE}").fetchone()
+    return int(row[0] or 0)
+
+def _record(cur, version: int, name: str):
+    cur.execute(f"INSERT INTO {VERSION_TABLE} (version, name, applied_at) VALUES (?, ?, ?)",
+                (version, name, datetime.utcnow().isoformat(sep=" ")))
+
+def upgrade(engine, fresh: bool = False) -> int:
+    """Runs pending migrations (a fresh database is only stamped) and returns the version."""
+    if engine.dialect.name != "sqlite":
+        logger.warning("schema migrations only support sqlite, skipping")
+        return 0
+    raw = engine.raw_connection()
+    try:
+        dbc = raw.driver_connection
+        old_isolation = dbc.isolation_level
+        # Manage transactions by hand: table rebuilds need foreign key
+        # enforcement off, which sqlite only allows outside a transaction.
+        dbc.isolation_level = None
+        cur = dbc.cursor()
+        try:
+            cur.execute("PRAGMA foreign_keys=OFF")
+            _ensure_version_table(cur)
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                version = _current_version(cur)
+                if fresh and version == 0:
+                    for v, name, _ in MIGRATIONS:
+                        _record(cur, v, name)
+                    version = HEAD
+                for v, name, fn in MIGRATIONS:
+                    if v <= version:
+                        continue
+                    logger.info("applying schema migration %s: %s", v, name)
+                    fn(cur)
+                    _record(cur, v, name)
+                    version = v
+                bad = cur.execute("PRAGMA foreign_key_check").fetchall()
+                if bad:
+                    raise RuntimeError(f"foreign key check failed after migration: {bad[:5]}")
+                cur.execute("COMMIT")
+            except Exception:
+                cur.execute("ROLLBACK")
+                raise
+            return version
+        finally:
+            cur.execute("PRAGMA foreign_keys=ON")
+            cur.close()
+            dbc.isolation_level = old_isolation
+    finally:
+        raw.close()
@@ -1,6 +1,6 @@
 from datetime import datetime
 from sqlalchemy.orm import Mapped, mapped_column
-from sqlalchemy import Integer, String, DateTime, Text, ForeignKey
+from sqlalchemy import Integer, String, DateTime, Text, ForeignKey, Index
 from sqlalchemy.types import JSON
 from .db import Base
 
@@ -11,32 +11,69 @@ class Project(Base):
     labels: Mapped[list] = mapped_column(JSON, nullable=False, default=[])
     relation_types: Mapped[list] = mapped_column(JSON, nullable=False, default=[])
     allow_overlap: Mapped[bool] = mapped_column(Integer, nullable=False, default=0)
+    # Regex labeling rules: [{"pattern", "label", "group"}], see rule_service
+    label_rules: Mapped[list] = mapped_column(JSON, nullable=False, default=[], server_default="[]")
+    revision: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default="0")
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
 class Document(Base):
     __tablename__ = "documents"
+    __table_args__ = (
+        Index("ix_documents_project_id_id", "project_id", "id"),
+        Index("ix_documents_project_id_status", "project_id", "status"),
+        Index("ux_documents_project_id_content_hash", "project_id", "content_hash", unique=True),
+    )
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
-    project_id: Mapped[int] = mapped_column(ForeignKey("projects.id"), index=True, nullable=False)
+    project_id: Mapped[int] = mapped_column(ForeignKey("projects.id", ondelete="CASCADE"), index=True, nullable=False)
     text: Mapped[str] = mapped_column(Text, nullable=False)
     status: Mapped[str] = mapped_column(String(32), nullable=False, default="pending")
     source_file: Mapped[str] = mapped_column(String(1024), nullable=True)
     unit_index: Mapped[int] = mapped_column(Integer, nullable=True)
+    # Character offsets of the unit in the decoded source file
+    start_offset: Mapped[int] = mapped_column(Integer, nullable=True)
+    end_offset: Mapped[int] = mapped_column(Integer, nullable=True)
+    # Normalized text hash of imported documents, unique per project; NULL
+    # for documents created or edited by hand
+    content_hash: Mapped[str] = mapped_column(String(64), nullable=True)
+    revision: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default="0")
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
 class Annotation(Base):
     __tablename__ = "annotations"
+    __table_args__ = (
+        Index("ix_annotations_doc_id_start_end", "doc_id", "start", "end"),
+    )
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
-    doc_id: Mapped[int] = mapped_column(ForeignKey("documents.id"), index=True, nullable=False)
+    doc_id: Mapped[int] = mapped_column(ForeignKey("documents.id", ondelete="CASCADE"), index=True, nullable=False)
     start: Mapped[int] = mapped_column(Integer, nullable=False)
     end: Mapped[int] = mapped_column(Integer, nullable=False)
     label: Mapped[str] = mapped_column(String(64), nullable=False)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
+class Suggestion(Base):
+    # Proposed spans for annotators to accept or reject; text is the matched
+    # surface, so a suggestion whose document text changed can be detected
+    __tablename__ = "suggestions"
+    __table_args__ = (
+        Index("ix_suggestions_doc_id_start_end", "doc_id", "start", "end"),
+    )
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    doc_id: Mapped[int] = mapped_column(ForeignKey("documents.id", ondelete="CASCADE"), nullable=False)
+    start: Mapped[int] = mapped_column(Integer, nullable=False)
+    end: Mapped[int] = mapped_column(Integer, nullable=False)
+    label: Mapped[str] = mapped_column(String(64), nullable=False)
+    text: Mapped[str] = mapped_column(Text, nullable=False)
+    source: Mapped[str] = mapped_column(String(32), nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
 class Relation(Base):
     __tablename__ = "relations"
+    __table_args__ = (
+        Index("ix_relations_doc_id_from_to_type", "doc_id", "from_ann_id", "to_ann_id", "relation_type"),
+    )
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
-    doc_id: Mapped[int] = mapped_column(ForeignKey("documents.id"), index=True, nullable=False)
-    from_ann_id: Mapped[int] = mapped_column(ForeignKey("annotations.id"), index=True, nullable=False)
-    to_ann_id: Mapped[int] = mapped_column(ForeignKey("annotations.id"), index=True, nullable=False)
+    doc_id: Mapped[int] = mapped_column(ForeignKey("documents.id", ondelete="CASCADE"), index=True, nullable=False)
+    from_ann_id: Mapped[int] = mapped_column(ForeignKey("annotations.id", ondelete="CASCADE"), index=True, nullable=False)
+    to_ann_id: Mapped[int] = mapped_column(ForeignKey("annotations.id", ondelete="CASCADE"), index=True, nullable=False)
     relation_type: Mapped[str] = mapped_column(String(64), nullable=False)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
\ No newline at end of file
@@ -0,0 +1,77 @@
+import os
+import sys
+import time
+import tempfile
+
+# Run against a throwaway database and data directory, never the shipped
+# annotation2.db or the repository's data/ folder
+_tmp = tempfile.mkdtemp(prefix="annotation2_bench_")
+os.environ.setdefault("ANNOTATION2_DATABASE_URL", "sqlite:///" + os.path.join(_tmp, "bench.db"))
+os.environ.setdefault("ANNOTATION2_DATA_DIR", os.path.join(_tmp, "data"))
+
+from annotation2.services import sync_service
+from annotation2.storage.db import get_session
+from annotation2.storage.schema import Document, Annotation, Relation
+
+# Each save (first one and re-save) must stay under this many seconds per
+# 10k spans (with as many relations); the default run saves 12k spans. The
+# speedup over the per-row baseline is reported and must reach MIN_SPEEDUP.
+MAX_SAVE_S_PER_10K_SPANS = 0.8
+MIN_SPEEDUP = 2.0
+
+def build_payload(n_docs: int, spans_per_doc: int):
+    docs = []
+    for i in range(n_docs):
+        text = "x" * (spans_per_doc * 4)
+        spans = [{"id": j + 1, "start": j * 4, "end": j * 4 + 3, "label": "A"} for j in range(spans_per_doc)]
+        relations = [{"fromId": j + 1, "toId": j + 2, "type": "R"} for j in range(spans_per_doc - 1)]
+        docs.append({"text": text, "spans": spans, "relations": relations})
+    return {"documents": docs}
+
+def per_row_save(project_id: int, data: dict):
+    # The save loop before bulk inserts: one flush per document and per span
+    s = get_session()
+    try:
+        for d_data in data["documents"]:
+            doc = Document(project_id=project_id, text=d_data["text"], status=d_data.get("status", "pending"))
+            s.add(doc)
+            s.flush()
+            id_map = {}
+            for sp in d_data.get("spans", []):
+                a = Annotation(doc_id=doc.id, start=sp["start"], end=sp["end"], label=sp["label"])
+                s.add(a)
+                s.flush()
+                id_map[sp["id"]] = a.id
+            for rel in d_data.get("relations", []):
+                if rel["fromId"] in id_map and rel["toId"] in id_map:
+                    s.add(Relation(doc_id=doc.id, from_ann_id=id_map[rel["fromId"]], to_ann_id=id_map[rel["toId"]], relation_type=rel["type"]))
+        s.commit()
+    finally:
+        s.close()
+
+def main(n_docs: int = 100, spans_per_doc: int = 120):
+    pid = sync_service.create_project("Bench", ["A"], ["R"])
+    baseline_pid = sync_service.create_project("Baseline", ["A"], ["R"])
+    payload = build_payload(n_docs, spans_per_doc)
+    t0 = time.perf_counter()
+    per_row_save(baseline_pid, payload)
+    t1 = time.perf_counter()
+    res = sync_service.save_project_data(pid, payload)
+    t2 = time.perf_counter()
+    # Second save rewrites the same documents by id
+    for d, saved in zip(payload["documents"], res["documents"]):
+        d["id"] = saved["id"]
+    sync_service.save_project_data(pid, payload)
+    t3 = time.perf_counter()
+    speedup = (t1 - t0) / (t2 - t1)
+    print({"documents": n_docs, "spans": n_docs * spans_per_doc, "relations": n_docs * (spans_per_doc - 1),
+           "per_row_s": round(t1 - t0, 3), "first_save_s": round(t2 - t1, 3), "resave_s": round(t3 - t2, 3),
+           "speedup": round(speedup, 1)})
+    limit = MAX_SAVE_S_PER_10K_SPANS * n_docs * spans_per_doc / 10000
+    assert t2 - t1 <= limit, f"first save took {t2 - t1:.3f}s, limit {limit:.3f}s"
+    assert t3 - t2 <= limit, f"re-save took {t3 - t2:.3f}s, limit {limit:.3f}s"
+    assert speedup >= MIN_SPEEDUP, f"bulk save only {speedup:.1f}x faster than per-row inserts"
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    main(*args)
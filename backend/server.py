@@ -1,17 +1,26 @@
 import os
 import sys
+import json
+import shutil
+import tempfile
 # Ensure the project root is in sys.path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
-from fastapi import FastAPI, HTTPException, Body, Response, Query
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, HTTPException, Body, Response, Query, Header, File, Form, UploadFile
+from fastapi.responses import FileResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from annotation2.services import export_service, sync_service, record_service, project_service
+from starlette.background import BackgroundTask
+from annotation2.services import export_service, sync_service, record_service, project_service, import_service, restore_service, batch_service, gazetteer_service, rule_service
+from annotation2.services.revision_service import RevisionConflict
+from annotation2.storage.db import init_db
 from Minimind_trianer.label_system.app import app as minimind_app
 from typing import Dict, Any, List, Optional
 
 app = FastAPI()
 
+# Create the schema once at startup instead of on every request
+init_db()
+
 # Mount Minimind Image Labeler
 app.mount("/minimind", minimind_app)
 
@@ -22,6 +31,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
 
 @app.get("/")
@@ -76,9 +86,45 @@ def delete_project_api(project_id: int):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def _project_etag(project_id: int, version: str) -> str:
+    return f'"p{project_id}-{version}"'
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    # If-None-Match: "*" or a comma-separated list, compared weakly
+    if if_none_match.strip() == "*":
+        return True
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
 @app.get("/api/projects/{project_id}/sync")
-def load_project_data(project_id: int):
-    data = sync_service.load_project_data(project_id)
+def load_project_data(project_id: int, cursor: Optional[int] = None, limit: Optional[int] = Query(None, ge=1, le=sync_service.MAX_LOAD_LIMIT), stream: bool = False, if_none_match: Optional[str] = Header(None)):
+    if not stream and cursor is None and limit is None:
+        # Full snapshot: ETag is the project version, so unchanged projects cost one lookup
+        version = sync_service.get_project_version(project_id)
+        if version is None:
+            raise HTTPException(status_code=404, detail="Project not found")
+        etag = _project_etag(project_id, version)
+        if if_none_match and _etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        snap = sync_service.get_project_snapshot(project_id)
+        if not snap:
+            raise HTTPException(status_code=404, detail="Project not found")
+        version, payload = snap
+        return Response(content=payload, media_type="application/json", headers={"ETag": _project_etag(project_id, version)})
+    if stream:
+        # NDJSON: the project header line first, then one line per document
+        try:
+            rows = sync_service.iter_project_data(project_id, cursor=cursor)
+        except ValueError:
+            raise HTTPException(status_code=404, detail="Project not found")
+        lines = (json.dumps(row, ensure_ascii=False) + "\n" for row in rows)
+        return StreamingResponse(lines, media_type="application/x-ndjson")
+    data = sync_service.load_project_data(project_id, cursor=cursor, limit=limit)
     if not data:
         raise HTTPException(status_code=404, detail="Project not found")
     return data
@@ -87,6 +133,19 @@ def load_project_data(project_id: int):
 def save_project_data(project_id: int, data: Dict[str, Any] = Body(...)):
     try:
         return sync_service.save_project_data(project_id, data)
+    except RevisionConflict as e:
+        raise HTTPException(status_code=409, detail={"message": str(e), "conflicts": e.conflicts})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.patch("/api/projects/{project_id}/sync")
+def apply_project_delta(project_id: int, data: Dict[str, Any] = Body(...)):
+    try:
+        return sync_service.apply_project_delta(project_id, data)
+    except RevisionConflict as e:
+        raise HTTPException(status_code=409, detail={"message": str(e), "conflicts": e.conflicts})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -120,20 +179,181 @@ def delete_document_api(doc_id: int):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/annotations/batch")
+def apply_batch_api(data: Dict[str, Any] = Body(...)):
+    # Per-operation errors are reported in the results; 409 means stale revisions
+    try:
+        return batch_service.apply_batch(data.get("ops") or [], atomic=bool(data.get("atomic", True)), revisions=data.get("revisions"))
+    except RevisionConflict as e:
+        raise HTTPException(status_code=409, detail={"message": str(e), "conflicts": e.conflicts})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/api/projects/{project_id}/export")
-def export_project_api(project_id: int, format: str = "json_v2", doc_ids: Optional[List[int]] = Query(None)):
-    try:
-        # Call the pure service function
-        # Note: export_service.export_project returns the absolute file path
-        file_path = export_service.export_project(project_id, fmt=format, doc_ids=doc_ids)
-        
-        if not os.path.exists(file_path):
-            raise HTTPException(status_code=500, detail="Export failed to generate file")
-            
-        filename = os.path.basename(file_path)
-        return FileResponse(path=file_path, filename=filename, media_type='application/json')
+def export_project_api(project_id: int, format: str = "json_v2", doc_ids: Optional[List[int]] = Query(None), gzip: bool = False, save: bool = False,
+                       workers: int = Query(1, ge=1, le=32), shard_files: bool = False, tokenization: str = "char",
+                       incremental: bool = False, reset: bool = False):
+    try:
+        if incremental:
+            # Delta file and manifest are kept under exports/; the summary says what changed
+            return export_service.export_incremental(project_id, fmt=format, compress=gzip, tokenization=tokenization, reset=reset)
+
+        if shard_files:
+            # Numbered shard files plus a manifest, kept under exports/
+            manifest_path = export_service.export_project_parallel(project_id, fmt=format, workers=workers, doc_ids=doc_ids, merge=False, compress=gzip, tokenization=tokenization)
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            manifest["path"] = os.path.dirname(os.path.abspath(manifest_path))
+            return manifest
+
+        if workers > 1:
+            out_dir = None if save else tempfile.mkdtemp(prefix="annotation2_export_")
+            file_path = export_service.export_project_parallel(project_id, fmt=format, workers=workers, output_dir=out_dir, doc_ids=doc_ids, compress=gzip, tokenization=tokenization)
+            media_type = "application/gzip" if gzip else export_service.MEDIA_TYPES[format.lower()]
+            cleanup = None if save else BackgroundTask(shutil.rmtree, out_dir, ignore_errors=True)
+            return FileResponse(path=file_path, filename=os.path.basename(file_path), media_type=media_type, background=cleanup)
+
+        if save:
+            # Opt-in: keep a copy under exports/ and serve that file
+            file_path = export_service.export_project(project_id, fmt=format, doc_ids=doc_ids, compress=gzip, tokenization=tokenization)
+            if not os.path.exists(file_path):
+                raise HTTPException(status_code=500, detail="Export failed to generate file")
+            filename = os.path.basename(file_path)
+            media_type = "application/gzip" if gzip else export_service.MEDIA_TYPES[format.lower()]
+            return FileResponse(path=file_path, filename=filename, media_type=media_type)
+
+        chunks = export_service.iter_export_bytes(project_id, fmt=format, doc_ids=doc_ids, compress=gzip, tokenization=tokenization)
+        filename = export_service.export_filename(project_id, format) + (".gz" if gzip else "")
+        media_type = "application/gzip" if gzip else export_service.MEDIA_TYPES[format.lower()]
+        return StreamingResponse(chunks, media_type=media_type, headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/projects/{project_id}/imports")
+def submit_import_api(project_id: int, files: List[UploadFile] = File(...), strategy: str = Form("sentence"), fixed_length: Optional[int] = Form(None),
+                      encoding: Optional[str] = Form(None), workers: int = Form(1), on_duplicate: str = Form("skip")):
+    # Uploads are spooled to a temp dir that the job removes when it ends
+    upload_dir = tempfile.mkdtemp(prefix="annotation2_import_")
+    try:
+        paths, names = [], []
+        for i, f in enumerate(files):
+            name = os.path.basename(f.filename or f"upload_{i}.txt")
+            path = os.path.join(upload_dir, f"{i:05d}_{name}")
+            with open(path, "wb") as out:
+                shutil.copyfileobj(f.file, out)
+            paths.append(path)
+            names.append(name)
+        job = import_service.submit_import_job(project_id, paths, strategy=strategy, fixed_length=fixed_length, encoding=encoding,
+                                               workers=max(1, min(workers, 32)), cleanup_dir=upload_dir, source_names=names,
+                                               on_duplicate=on_duplicate)
+        return job.to_dict()
+    except ValueError as e:
+        shutil.rmtree(upload_dir, ignore_errors=True)
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        shutil.rmtree(upload_dir, ignore_errors=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/projects/{project_id}/restore")
+def restore_project_api(project_id: int, file: UploadFile = File(...), format: str = Form("auto"), extend_schema: bool = Form(True)):
+    # Keep the upload's extension (.json/.jsonl/.gz) for format detection
+    name = os.path.basename(file.filename or "upload.jsonl")
+    fd, path = tempfile.mkstemp(prefix="annotation2_restore_", suffix="_" + name)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            shutil.copyfileobj(file.file, out)
+        return restore_service.restore_file(project_id, path, fmt=format, extend_schema=extend_schema)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        os.remove(path)
+
+@app.post("/api/projects/{project_id}/pre-annotate")
+def pre_annotate_api(project_id: int, dictionaries: List[UploadFile] = File([]), default_label: Optional[str] = Form(None),
+                     use_annotations: bool = Form(True), min_length: int = Form(2)):
+    # Dictionaries are "term<TAB>label" lines, or bare terms of default_label
+    entries = []
+    try:
+        for f in dictionaries:
+            fd, path = tempfile.mkstemp(prefix="annotation2_dict_")
+            try:
+                with os.fdopen(fd, "wb") as out:
+                    shutil.copyfileobj(f.file, out)
+                entries.extend(gazetteer_service.parse_dictionary(path, default_label=default_label))
+            finally:
+                os.remove(path)
+        return gazetteer_service.pre_annotate(project_id, entries, use_annotations=use_annotations, min_length=max(1, min_length))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/documents/{doc_id}/suggestions")
+def list_suggestions_api(doc_id: int):
+    return gazetteer_service.list_suggestions(doc_id)
+
+@app.post("/api/suggestions/accept")
+def accept_suggestions_api(data: Dict[str, Any] = Body(...)):
+    try:
+        return gazetteer_service.accept_suggestions(ids=data.get("ids"), doc_id=data.get("doc_id"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/suggestions/reject")
+def reject_suggestions_api(data: Dict[str, Any] = Body(...)):
+    try:
+        return {"removed": gazetteer_service.reject_suggestions(ids=data.get("ids"), doc_id=data.get("doc_id"))}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/projects/{project_id}/rules")
+def get_rules_api(project_id: int):
+    try:
+        return rule_service.get_rules(project_id)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+@app.put("/api/projects/{project_id}/rules")
+def set_rules_api(project_id: int, rules: List[Dict[str, Any]] = Body(...)):
+    try:
+        return rule_service.set_rules(project_id, rules)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/api/projects/{project_id}/rules/apply")
+def apply_rules_api(project_id: int, data: Dict[str, Any] = Body({})):
+    # "rules" runs ad-hoc rules instead of the stored ones, e.g. to dry-run edits
+    try:
+        workers = max(1, min(int(data.get("workers", 1)), 32))
+        return rule_service.apply_rules(project_id, rules=data.get("rules"), dry_run=bool(data.get("dry_run", False)), workers=workers)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/imports/{job_id}")
+def get_import_api(job_id: str):
+    try:
+        return import_service.get_import_job(job_id).to_dict()
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+@app.delete("/api/imports/{job_id}")
+def cancel_import_api(job_id: str):
+    try:
+        return import_service.cancel_import_job(job_id).to_dict()
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
 
 if __name__ == "__main__":
     import uvicorn
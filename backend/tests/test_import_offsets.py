@@ -0,0 +1,24 @@
+import pytest
+from annotation2.services.import_service import iter_file_text, iter_source_unit_spans, iter_unit_spans, SourceOffsets
+
+CRLF_TEXT = "First line.\r\nSecond one.\r\n\r\nThird, after a blank line.\r\nFourth.\r\n"
+
+def _write(tmp_path, text):
+    path = tmp_path / "units.txt"
+    path.write_bytes(text.encode("utf-8"))
+    return str(path)
+
+def test_crlf_sentence_offsets_point_into_source(tmp_path):
+    path = _write(tmp_path, "First line.\r\nSecond one.\r\n")
+    assert list(iter_source_unit_spans(path, "sentence", encoding="utf-8")) == [(0, 11, "First line."), (13, 24, "Second one.")]
+
+@pytest.mark.parametrize("strategy", ["sentence", "paragraph", "length", "as_is"])
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 4096])
+def test_crlf_offsets_any_strategy_and_chunking(tmp_path, strategy, chunk_size):
+    path = _write(tmp_path, CRLF_TEXT)
+    offsets = SourceOffsets()
+    units = list(iter_unit_spans(iter_file_text(path, "utf-8", chunk_size, crlf=offsets.crlf), strategy, 10))
+    assert units
+    for start, end, text in units:
+        start, end = offsets.map(start), offsets.map(end)
+        assert CRLF_TEXT[start:end].replace("\r\n", "\n") == text
@@ -0,0 +1,40 @@
+import pytest
+from annotation2.services.import_service import iter_unit_spans, split_text
+
+@pytest.mark.parametrize("text, expected", [
+    ("I said no. Next one.", ["I said no.", "Next one."]),
+    ("See No. 5 and Fig. 2 here. Done.", ["See No. 5 and Fig. 2 here.", "Done."]),
+    ("Mr. Smith came. Dr. Jones left.", ["Mr. Smith came.", "Dr. Jones left."]),
+    ("Use e.g. apples. Ok.", ["Use e.g. apples.", "Ok."]),
+    ("U.S. He left.", ["U.S.", "He left."]),
+    ("The U.S. economy grew. It did.", ["The U.S. economy grew.", "It did."]),
+    ("Pi is 3.14 and v1.2.3 ships. Alloy 6061.T6 too.", ["Pi is 3.14 and v1.2.3 ships.", "Alloy 6061.T6 too."]),
+])
+def test_abbreviations(text, expected):
+    assert split_text(text, "sentence") == expected
+
+@pytest.mark.parametrize("text, expected", [
+    ('He said "Stop." Then left.', ['He said "Stop."', "Then left."]),
+    ("It failed (again.) We retried!」 Fine.", ["It failed (again.)", "We retried!」", "Fine."]),
+    ("A (see fig. 3) test. B.", ["A (see fig. 3) test.", "B."]),
+])
+def test_closing_quotes_and_brackets(text, expected):
+    assert split_text(text, "sentence") == expected
+
+def test_cjk_terminators():
+    assert split_text("今日は晴れ。明日は雨！「本当？」はい．", "sentence") == ["今日は晴れ。", "明日は雨！", "「本当？」", "はい．"]
+    assert split_text("彼は来た。He left. 終わり", "sentence") == ["彼は来た。", "He left.", "終わり"]
+
+TEXT = 'I said no. See No. 5.  U.S. He left. "Stop." 今日は晴れ。Mr. Smith came.\nEnd'
+
+@pytest.mark.parametrize("cut", range(1, len(TEXT)))
+def test_split_across_chunk_boundary(cut):
+    whole = list(iter_unit_spans([TEXT], "sentence"))
+    assert list(iter_unit_spans([TEXT[:cut], TEXT[cut:]], "sentence")) == whole
+
+@pytest.mark.parametrize("size", [1, 2, 5])
+def test_split_with_small_chunks(size):
+    chunks = [TEXT[i:i + size] for i in range(0, len(TEXT), size)]
+    units = list(iter_unit_spans(chunks, "sentence"))
+    assert [u[2] for u in units] == ["I said no.", "See No. 5.", "U.S.", "He left.", '"Stop."', "今日は晴れ。", "Mr. Smith came.", "End"]
+    assert all(TEXT[s:e] == t for s, e, t in units)